@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for the parsing, serialisation and packaging hot paths of
+epub.format, run against synthetic books of increasing size.
+
+Each case runs in a fresh process, so that its peak memory can be measured
+from the growth in the process' maximum resident set size. Results are
+written as JSON, and a previous results file can be passed with --compare
+to print the relative change for each case.
+
+    python bench/bench_format.py --output results.json
+    python bench/bench_format.py --sizes 10 1000 --compare results.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from epub.format import Epub, Container, Publication, TableOfContents
+from epub.format.toc import NavPoint
+
+DEFAULT_SIZES = [10, 1000, 10000, 100000]
+DEFAULT_DEPTHS = [1, 4]
+CHAPTER = (b'<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+        + b'<p>It was a dark and stormy night.</p>' * 20
+        + b'</body></html>')
+
+
+def make_publication(size):
+    """Return a Publication with `size` manifest items."""
+    pub = Publication('unique-id', 'Benchmark', 'Mark Smith', 'Smith, Mark')
+    for index in range(size):
+        if index % 4:
+            pub.add_item('chapter%d.html' % index, 'c%d' % index)
+        else:
+            pub.add_item('image%d.png' % index, 'i%d' % index)
+    return pub
+
+
+def make_toc(size, depth):
+    """
+    Return a TableOfContents with `size` NavPoints, nested into chains of
+    `depth` levels.
+    """
+    toc = TableOfContents('unique-id', 'Benchmark', 'Mark Smith')
+    parent = toc
+    for index in range(size):
+        if index % depth == 0:
+            parent = toc
+        npoint = NavPoint('Point %d' % index, 'chapter%d.html' % index,
+                'np%d' % index)
+        parent.nav_points.append(npoint)
+        parent = npoint
+    return toc
+
+
+def make_container(size):
+    """Return a Container with `size` rootfiles."""
+    container = Container()
+    for index in range(size):
+        container.add_rootfile('OEBPS/content%d.opf' % index)
+    return container
+
+
+# Each case takes (size, depth), does any setup that should not be measured,
+# and returns a function which performs the work to be measured.
+
+def case_publication_add_item(size, depth):
+    return lambda: make_publication(size)
+
+def case_publication_from_string(size, depth):
+    opf = make_publication(size).as_opf().encode('utf-8')
+    return lambda: Publication.from_string(opf)
+
+def case_publication_as_opf(size, depth):
+    pub = make_publication(size)
+    return pub.as_opf
+
+def case_publication_write_opf(size, depth):
+    pub = make_publication(size)
+    return lambda: pub.write_opf(BytesIO())
+
+def case_toc_from_string(size, depth):
+    ncx = make_toc(size, depth).to_ncx().encode('utf-8')
+    return lambda: TableOfContents.from_string(ncx)
+
+def case_toc_to_ncx(size, depth):
+    toc = make_toc(size, depth)
+    return toc.to_ncx
+
+def case_container_as_epub_container(size, depth):
+    container = make_container(size)
+    return container.as_epub_container
+
+def case_epub_writestr(size, depth):
+    def package():
+        with Epub(BytesIO()) as book:
+            for index in range(size):
+                book.writestr('OEBPS/chapter%d.html' % index, CHAPTER)
+    return package
+
+# name -> (case, whether the case depends on TOC depth)
+CASES = {
+    'publication.add_item': (case_publication_add_item, False),
+    'publication.from_string': (case_publication_from_string, False),
+    'publication.as_opf': (case_publication_as_opf, False),
+    'publication.write_opf': (case_publication_write_opf, False),
+    'toc.from_string': (case_toc_from_string, True),
+    'toc.to_ncx': (case_toc_to_ncx, True),
+    'container.as_epub_container': (case_container_as_epub_container, False),
+    'epub.writestr': (case_epub_writestr, False),
+}
+
+
+def max_rss_kb():
+    """Return the peak resident set size of this process, in kilobytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X, and kilobytes elsewhere:
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def _measure(name, size, depth, repeat, conn):
+    """Run a single case in a child process, sending its result to conn."""
+    try:
+        work = CASES[name][0](size, depth)
+        before = max_rss_kb()
+        timings = []
+        for _ in range(repeat):
+            start = time.time()
+            work()
+            timings.append(time.time() - start)
+        conn.send({
+            'case': name,
+            'size': size,
+            'depth': depth,
+            'seconds': min(timings),
+            'peak_rss_growth_kb': max_rss_kb() - before,
+        })
+    except Exception as err:
+        conn.send({'case': name, 'size': size, 'depth': depth,
+                'error': repr(err)})
+    finally:
+        conn.close()
+
+
+def measure(name, size, depth, repeat):
+    """Run a case in a fresh process and return its result dict."""
+    parent, child = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target=_measure,
+            args=(name, size, depth, repeat, child))
+    process.start()
+    result = parent.recv()
+    process.join()
+    return result
+
+
+def compare(results, previous):
+    """Print the change in time for each case also present in `previous`."""
+    def key(result):
+        return result['case'], result['size'], result['depth']
+    old = dict((key(r), r) for r in previous['results'] if 'seconds' in r)
+    for result in results:
+        before = old.get(key(result))
+        if before and 'seconds' in result and before['seconds']:
+            print('%-30s size=%-7d depth=%-2d %+7.1f%%' % (key(result) + (
+                    100.0 * (result['seconds'] - before['seconds'])
+                    / before['seconds'],)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+',
+            default=DEFAULT_SIZES)
+    parser.add_argument('--depths', type=int, nargs='+',
+            default=DEFAULT_DEPTHS)
+    parser.add_argument('--cases', nargs='+', default=sorted(CASES),
+            choices=sorted(CASES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', metavar='PATH',
+            help="write results as JSON to PATH")
+    parser.add_argument('--compare', metavar='PATH',
+            help="compare against results previously written to PATH")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.cases:
+        depths = args.depths if CASES[name][1] else [1]
+        for size in args.sizes:
+            for depth in depths:
+                result = measure(name, size, depth, args.repeat)
+                results.append(result)
+                if 'error' in result:
+                    print('%-30s size=%-7d depth=%-2d error: %s' % (
+                            name, size, depth, result['error']))
+                else:
+                    print('%-30s size=%-7d depth=%-2d %10.4fs %8dkB' % (
+                            name, size, depth, result['seconds'],
+                            result['peak_rss_growth_kb']))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.time(),
+                'results': results,
+            }, output, indent=2)
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(results, json.load(previous))
+
+
+if __name__ == '__main__':
+    main()
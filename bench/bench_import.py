@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measures how long it takes to import each public module of the package, and
+which heavy dependencies each import pulls in.
+
+Each import is timed in a fresh interpreter, several times over, and the
+fastest run is reported. Results are written as JSON, and a previous
+results file can be passed with --compare to print the relative change for
+each module, as bench_format.py does.
+
+    python bench/bench_import.py --output imports.json
+    python bench/bench_import.py --compare imports.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+DEFAULT_MODULES = [
+    'epub.format',
+    'epub.format.archive',
+    'epub.format.cache',
+    'epub.format.validate',
+    'epub.build.batch',
+    'epub.build.pipeline',
+    'epub.process.transform',
+]
+# Dependencies whose import is reported, as they are the most expensive:
+HEAVY = ['lxml.etree', 'jinja2', 'multiprocessing.pool']
+
+# Run in the child interpreter with the module name as its argument:
+CHILD = """
+import json, sys, time
+start = time.time()
+__import__(sys.argv[1])
+seconds = time.time() - start
+json.dump([seconds, [name for name in %r if name in sys.modules]],
+        sys.stdout)
+""" % (HEAVY,)
+
+
+def measure(module, repeat):
+    """Import `module` in `repeat` fresh interpreters, returning a dict."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+            [ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+                [sys.executable, '-c', CHILD, module], env=env)
+        seconds, heavy = json.loads(output.decode('utf-8'))
+        timings.append(seconds)
+    return {'module': module, 'seconds': min(timings), 'imports': heavy}
+
+
+def compare(results, previous):
+    """Print the change in time for each module also in `previous`."""
+    old = dict((r['module'], r) for r in previous['results'])
+    for result in results:
+        before = old.get(result['module'])
+        if before and before['seconds']:
+            print('%-30s %+7.1f%%' % (result['module'],
+                    100.0 * (result['seconds'] - before['seconds'])
+                    / before['seconds']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', nargs='+', default=DEFAULT_MODULES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', metavar='PATH',
+            help="write results as JSON to PATH")
+    parser.add_argument('--compare', metavar='PATH',
+            help="compare against results previously written to PATH")
+    args = parser.parse_args(argv)
+
+    results = []
+    for module in args.modules:
+        result = measure(module, args.repeat)
+        results.append(result)
+        print('%-30s %8.1fms  %s' % (module, result['seconds'] * 1000,
+                ', '.join(result['imports']) or '-'))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.time(),
+                'results': results,
+            }, output, indent=2)
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(results, json.load(previous))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+"""
+Builds many epub files in parallel from declarative JSON specs.
+
+Each spec describes a single book:
+
+    {
+        "output": "sedan-chair.epub",
+        "unique_id": "0f8f4c3e-...",
+        "title": "The Sedan Chair",
+        "author": "Mark Smith",
+        "fileas": "Smith, Mark",
+        "lang": "en-GB",
+        "files": [
+            {"path": "src/c1.html", "href": "c1.html", "id": "c1"},
+            {"path": "src/cover.jpg", "href": "cover.jpg"}
+        ],
+        "toc": [
+            {"label": "Chapter 1", "link": "c1.html", "children": []}
+        ]
+    }
+
+Relative paths are resolved against the directory containing the spec. Each
+file may also specify "media_type" and "spine", as accepted by
+Publication.add_item. "lang", "opf_path" (default "OEBPS/content.opf") and
+"toc" are optional. If "reproducible" is true, the book is built with stable
+ids and fixed archive metadata, so rebuilding unchanged input produces an
+identical file. "memory_budget" and "workers" are passed to Epub, to cap the
+member data held in memory and to compress members in parallel.
+
+If "split_size" is given, HTML and XHTML files which specify no
+"media_type", are not excluded from the spine, and are larger than that
+many bytes are split into several parts (see epub.process.split), and links
+to them are rewritten. The parts take the place of the file in the manifest
+and spine.
+
+Run as `python -m epub.build.batch [-j N] [--report PATH] SPEC...`.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import posixpath
+import sys
+import time
+import traceback
+
+from epub.format import Epub, Container, Publication, TableOfContents
+from epub.format.toc import NavPoint
+
+__all__ = ['build_book', 'build_all', 'main']
+
+DEFAULT_OPF_PATH = 'OEBPS/content.opf'
+NCX_HREF = 'toc.ncx'
+# Files which may be split when a spec gives a split_size:
+SPLIT_EXTENSIONS = frozenset(['.html', '.xhtml', '.htm'])
+
+
+def load_spec(spec_path):
+    """
+    Load the JSON spec at `spec_path`, returning it as a dict with its
+    relative paths resolved.
+    """
+    with open(spec_path) as spec_file:
+        spec = json.load(spec_file)
+    base = os.path.dirname(os.path.abspath(spec_path))
+    spec['output'] = os.path.join(base, spec['output'])
+    for entry in spec['files']:
+        entry['path'] = os.path.join(base, entry['path'])
+    return spec
+
+
+def build_book(spec_path):
+    """
+    Build the epub described by the spec at `spec_path`. Returns a dict
+    describing the result, containing the spec path, output path, whether
+    the build succeeded, the error if it did not, the time taken and the
+    peak bytes of member data buffered (see Epub's memory_budget).
+    
+    Each book is built in a temporary file beside its output, which only
+    replaces the output once the book is complete and valid, so a failed
+    build leaves any previous book in place. Books are validated as they are
+    built (see epub.format.validate); one with validation errors is
+    discarded, and the errors are reported as dicts under 'errors'.
+    
+    Exceptions are caught and reported in the result, so one bad book does
+    not interrupt a batch.
+    """
+    result = {'spec': spec_path, 'output': None, 'ok': False, 'error': None,
+            'errors': [], 'peak_buffered': None}
+    start = time.time()
+    try:
+        spec = load_spec(spec_path)
+        result['output'] = spec['output']
+        errors, result['peak_buffered'] = _build(spec)
+        result['errors'] = [dict(error._asdict()) for error in errors]
+        if errors:
+            result['error'] = ''.join('%s\n' % (error,) for error in errors)
+        else:
+            result['ok'] = True
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['seconds'] = time.time() - start
+    return result
+
+
+def _build(spec):
+    """
+    Write the epub described by the loaded `spec`, returning a list of
+    any validation errors and the Epub's peak_buffered. The output is only
+    replaced if the book is written without errors.
+    """
+    opf_path = spec.get('opf_path', DEFAULT_OPF_PATH)
+    container = Container()
+    container.add_rootfile(opf_path)
+    reproducible = spec.get('reproducible', False)
+    pub = Publication(spec['unique_id'], spec['title'], spec['author'],
+            spec['fileas'], reproducible)
+    if 'lang' in spec:
+        pub.lang = spec['lang']
+    toc = None
+    if 'toc' in spec:
+        toc = TableOfContents(spec['unique_id'], spec['title'],
+                spec['author'], reproducible)
+        _add_nav_points(toc, spec['toc'])
+        pub.add_item(NCX_HREF, 'ncx')
+
+    output = spec['output']
+    temp_path = '%s.%d.tmp' % (output, os.getpid())
+    try:
+        errors, peak_buffered = _write_book(temp_path, spec, container, pub,
+                toc)
+        if not errors:
+            if os.name == 'nt' and os.path.exists(output):
+                # Windows will not rename over an existing file:
+                os.remove(output)
+            os.rename(temp_path, output)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return errors, peak_buffered
+
+
+def _write_book(path, spec, container, pub, toc):
+    """Write the book for `spec` to `path`, as described by _build."""
+    opf_path = spec.get('opf_path', DEFAULT_OPF_PATH)
+    opf_dir = posixpath.dirname(opf_path)
+    with Epub(path, spec.get('workers'),
+            reproducible=spec.get('reproducible', False),
+            memory_budget=spec.get('memory_budget')) as book:
+        book.writestr('META-INF/container.xml',
+                container.as_epub_container())
+        if spec.get('split_size'):
+            _write_split(book, spec, pub, toc, opf_dir)
+        else:
+            for entry in spec['files']:
+                pub.add_item(entry['href'], entry.get('id'),
+                        entry.get('spine'), entry.get('media_type'))
+                book.write(entry['path'],
+                        posixpath.join(opf_dir, entry['href']))
+        if toc is not None:
+            with book.open_entry(posixpath.join(opf_dir, NCX_HREF)) as entry:
+                toc.write_ncx(entry)
+        with book.open_entry(opf_path) as entry:
+            pub.write_opf(entry)
+        errors = book.validate(container, pub, toc)
+    return errors, book.peak_buffered
+
+
+def _write_split(book, spec, pub, toc, opf_dir):
+    """
+    Register and write every file in `spec`, in order, splitting the
+    splittable documents.
+    """
+    from epub.process.split import split_documents
+    documents = []
+    paths = {}
+    for entry in spec['files']:
+        extension = posixpath.splitext(entry['href'])[1].lower()
+        options = {'spine_item': entry.get('spine'),
+                'media_type': entry.get('media_type')}
+        data = None
+        if (extension in SPLIT_EXTENSIONS and entry.get('spine') is not False
+                and 'media_type' not in entry):
+            with open(entry['path'], 'rb') as source:
+                data = source.read()
+        else:
+            paths[entry['href']] = entry['path']
+        documents.append((entry['href'], data, entry.get('id'), options))
+    for href, data in split_documents(documents, pub, toc,
+            spec['split_size']):
+        if data is None:
+            book.write(paths[href], posixpath.join(opf_dir, href))
+        else:
+            book.writestr(posixpath.join(opf_dir, href), data)
+
+
+def _add_nav_points(toc, entries):
+    """Add NavPoints to `toc` for the nested spec `entries`."""
+    stack = [(toc, entries)]
+    while stack:
+        parent, children = stack.pop()
+        for entry in children:
+            npoint = NavPoint(entry['label'], entry['link'], entry.get('id'),
+                    entry.get('class'))
+            parent.nav_points.append(npoint)
+            stack.append((npoint, entry.get('children', [])))
+
+
+def build_all(spec_paths, processes=None, progress=None):
+    """
+    Build the epub for each spec in `spec_paths` on a pool of `processes`
+    worker processes (by default, one per CPU), and return a list of
+    build_book results in the order the builds finished.
+    
+    If provided, `progress` is called with each result as it arrives.
+    """
+    pool = multiprocessing.Pool(processes)
+    results = []
+    try:
+        for result in pool.imap_unordered(build_book, spec_paths):
+            results.append(result)
+            if progress is not None:
+                progress(result)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+
+def summarise(results):
+    """Return a summary dict for a list of build_book results."""
+    failed = [result for result in results if not result['ok']]
+    return {
+        'total': len(results),
+        'succeeded': len(results) - len(failed),
+        'failed': len(failed),
+        'seconds': sum(result['seconds'] for result in results),
+        'results': results,
+    }
+
+
+def main(argv=None):
+    """Command-line entry point. Returns the process exit status."""
+    parser = argparse.ArgumentParser(
+            description="Build epub files from JSON specs.")
+    parser.add_argument('specs', nargs='+', metavar='SPEC',
+            help="path to a JSON book spec")
+    parser.add_argument('-j', '--processes', type=int, default=None,
+            help="number of worker processes (default: one per CPU)")
+    parser.add_argument('--report', metavar='PATH',
+            help="write a JSON summary report to PATH")
+    args = parser.parse_args(argv)
+
+    count = [0]
+    def progress(result):
+        count[0] += 1
+        status = 'ok' if result['ok'] else 'FAILED'
+        sys.stderr.write('[%d/%d] %s %s (%.2fs)\n' % (count[0],
+                len(args.specs), status, result['spec'], result['seconds']))
+        if not result['ok']:
+            sys.stderr.write(result['error'])
+
+    summary = summarise(build_all(args.specs, args.processes, progress))
+    sys.stderr.write('%(succeeded)d of %(total)d books built, '
+            '%(failed)d failed\n' % summary)
+    if args.report:
+        with open(args.report, 'w') as report:
+            json.dump(summary, report, indent=2)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
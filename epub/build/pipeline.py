@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cleans and transforms many XHTML files in-process, as a faster alternative to
+the per-file Tidy and XMLBuilder steps in epub.build.scons.
+
+A Pipeline parses each source once, passes the tree through each of its
+steps in turn, and serialises it once:
+
+    from epub.process.transform import Transformer
+
+    cleanup = Transformer()
+    cleanup.unwrap(xhtml + 'span')
+    with Pipeline([cleanup, add_chapter_ids], tidy=True) as pipeline:
+        pipeline.build([('src/c1.html', 'build/c1.html'), ...])
+
+Steps are callables which take an lxml ElementTree and modify it in place, as
+XMLBuilder.process does. They are run on a pool of worker processes which is
+kept for the life of the Pipeline, so steps must be picklable: module-level
+functions, or instances such as Transformers.
+
+Targets are only rebuilt when the content of their source, or the pipeline
+itself, has changed since they were last built. Signatures are kept in a JSON
+file, by default '.pipeline-signatures' in the current directory.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+
+from lxml import etree
+
+from epub.process.lxmlext import xhtml, xhtmlns
+from epub.process.transform import Transformer
+
+__all__ = ['Pipeline', 'tidy']
+
+DEFAULT_SIGNATURE_PATH = '.pipeline-signatures'
+
+
+def tidy(data, encoding='utf-8'):
+    """
+    Parse the (possibly malformed) HTML or XHTML document in the bytes `data`,
+    in the same way as a browser would, and return it as a well-formed XHTML
+    ElementTree.
+    """
+    parser = etree.HTMLParser(encoding=encoding, remove_pis=True)
+    parsed = etree.fromstring(data, parser)
+    if parsed is None:
+        raise ValueError("Document is empty")
+    attrib = dict(parsed.attrib)
+    attrib.pop('xmlns', None)
+    root = etree.Element(xhtml + 'html', attrib, nsmap={None: xhtmlns})
+    root.text = parsed.text
+    root.extend(parsed)
+    for element in root.iter(etree.Element):
+        if not element.tag.startswith('{'):
+            element.tag = xhtml + element.tag
+    return etree.ElementTree(root)
+
+
+def _step_name(step):
+    """
+    Identify `step`, including its configuration, for the pipeline
+    signature.
+    """
+    named = step if hasattr(step, '__name__') else type(step)
+    return '%s.%s:%s' % (named.__module__, named.__name__,
+            hashlib.sha1(_step_config(step)).hexdigest())
+
+
+def _step_config(step):
+    """
+    Return bytes describing the configuration of `step`. Transformer rules
+    are sorted, as the order of their dicts and sets is arbitrary; other
+    steps are pickled.
+    """
+    if isinstance(step, Transformer):
+        stripped = [(tag, None if attributes is None else sorted(attributes))
+                for tag, attributes in sorted(step.stripped.items())]
+        return repr([sorted(step.renames.items()), stripped,
+                sorted(step.unwrapped), sorted(step.dropped)]).encode('utf-8')
+    return pickle.dumps(step, 2)
+
+
+def _signature(data, key):
+    """Return the signature of source content `data` for pipeline `key`."""
+    digest = hashlib.sha1(key.encode('utf-8'))
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def _build_one(args):
+    """
+    Pool worker: build `target` from `source` unless it is up-to-date
+    according to `known`, its previous signature. Returns a
+    (target, signature, built) tuple.
+    """
+    steps, use_tidy, key, source, target, known = args
+    with open(source, 'rb') as source_file:
+        data = source_file.read()
+    signature = _signature(data, key)
+    if signature == known and os.path.exists(target):
+        return target, signature, False
+    if use_tidy:
+        tree = tidy(data)
+    else:
+        tree = etree.ElementTree(etree.fromstring(data))
+    for step in steps:
+        step(tree)
+    target_dir = os.path.dirname(target)
+    if target_dir and not os.path.isdir(target_dir):
+        try:
+            os.makedirs(target_dir)
+        except OSError:
+            # Another worker may have just created it:
+            if not os.path.isdir(target_dir):
+                raise
+    tree.write(target, encoding='utf-8', xml_declaration=True)
+    return target, signature, True
+
+
+class Pipeline(object):
+    """
+    A chain of steps applied to many files on a persistent worker pool.
+    
+    If `tidy` is True, sources are cleaned up with tidy() before the first
+    step; otherwise they must be well-formed XML. `version` is included in
+    each signature, along with the name and configuration of each step (the
+    rules of a Transformer, or the pickled state of other steps), and should
+    be changed whenever the code of a step changes, so that every target is
+    rebuilt.
+    """
+
+    def __init__(self, steps, tidy=False, processes=None,
+            signature_path=DEFAULT_SIGNATURE_PATH, version=''):
+        self.steps = list(steps)
+        self.tidy = tidy
+        self.processes = processes
+        self.signature_path = signature_path
+        self.key = ' '.join([version, str(tidy)]
+                + [_step_name(step) for step in self.steps])
+        self._pool = None
+        self._signatures = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    @property
+    def signatures(self):
+        """A dict of target path -> signature of its last successful build."""
+        if self._signatures is None:
+            self._signatures = {}
+            if self.signature_path and os.path.exists(self.signature_path):
+                with open(self.signature_path) as signature_file:
+                    self._signatures = json.load(signature_file)
+        return self._signatures
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+        return self._pool
+
+    def build(self, pairs):
+        """
+        Build each target from its source, given as an iterable of
+        (source, target) path pairs. Targets whose source has not changed
+        since their last build are skipped. Returns the list of targets
+        that were rebuilt.
+        """
+        signatures = self.signatures
+        jobs = [(self.steps, self.tidy, self.key, source, target,
+                signatures.get(target)) for source, target in pairs]
+        built = []
+        try:
+            for target, signature, rebuilt in self.pool.imap_unordered(
+                    _build_one, jobs):
+                signatures[target] = signature
+                if rebuilt:
+                    built.append(target)
+        finally:
+            # Keep the signatures of whatever was built before any failure:
+            self.save()
+        return built
+
+    def save(self):
+        """Write the signatures to signature_path."""
+        if self.signature_path and self._signatures is not None:
+            with open(self.signature_path, 'w') as signature_file:
+                json.dump(self._signatures, signature_file, indent=0,
+                        sort_keys=True)
+
+    def close(self):
+        """Wait for the worker pool to finish and shut it down."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def terminate(self):
+        """Shut the worker pool down immediately."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
@@ -43,4 +43,21 @@ class XMLBuilder(PythonBuilder):
 
 class Copy(PythonBuilder):
     def action(self, target, source, env):
-        shutil.copyfile(source[0].get_abspath(), target[0].get_abspath())
\ No newline at end of file
+        shutil.copyfile(source[0].get_abspath(), target[0].get_abspath())
+
+class PipelineBuilder(PythonBuilder):
+    """
+    Runs an epub.build.pipeline.Pipeline in-process, in place of chained
+    Tidy and XMLBuilder steps. SCons hands every out-of-date source to a
+    single action call, so the whole batch shares the pipeline's worker pool.
+    """
+    def __init__(self, name, env, pipeline):
+        self.pipeline = pipeline
+        # No emitter: extra sources would break the source/target pairing,
+        # and the pipeline's own signatures track changes to its steps.
+        builder = Builder(action=Action(self.action, batch_key=True))
+        env.Append(BUILDERS = { name: builder })
+
+    def action(self, target, source, env):
+        self.pipeline.build([(s.get_abspath(), t.get_abspath())
+                for s, t in zip(source, target)])
@@ -5,6 +5,7 @@ A module for creating epub files (although designed so that it may deal with)
 other formats in the future.
 
     epub.format.Epub :: A class for creating OCF-compliant epub files.
+    epub.format.EpubReader :: A class for lazily reading existing epub files.
     epub.format.Container :: A simple encapsulation of an epub container.xml
         file, capable of parsing and generating said file format.
     epub.format.TableOfContents :: A class for encapsulating toc data, capable of
@@ -13,47 +14,397 @@ other formats in the future.
         of a single publication, and can parse and generate OPF files.
 """
 
+import collections
+import copy
+import os
+import posixpath
 import random
+import shutil
+import struct
+import tempfile
 import zipfile
+
+from epub import instrument
+from epub.format import archive, validate
 from epub.format.container import Container
 from epub.format.toc import TableOfContents
-from epub.format.publication import Publication
+from epub.format.publication import Publication, NCX_MEDIA_TYPE
+
+__all__ = ['Epub', 'EpubReader', 'Container', 'TableOfContents', 'Publication']
+
+MIMETYPE = b'application/epub+zip'
+CONTAINER_PATH = 'META-INF/container.xml'
 
-__all__ = ['Epub', 'Container', 'TableOfContents', 'Publication']
+# Real files larger than this are streamed into the archive by Epub.write,
+# rather than being read into memory:
+STREAM_THRESHOLD = 16 * 1024 * 1024
 
 # The random id-generator picks characters from the following string:
 ID_COMPONENTS = "abcdefghijklmnopqrstuvwxyz"
 
 class Epub(object):
     """
-    Creates and manages epub files. Currently only capable of writing OCF
-    archives, not capable of reading them.
+    Creates and manages epub files. Only capable of writing OCF archives; use
+    Epub.open or EpubReader to read them.
     
-    Initialise with Epub('path-to-file'), and then use write(path), and
-    writestr(path, bytes) to add content. Epub does not itself manage essential
-    epub contents, such as container.xml and the necessary OPF files.
+    Initialise with Epub('path-to-file'), and then use write(path),
+    writestr(path, bytes) or open_entry(path) to add content. Epub does not
+    itself manage essential epub contents, such as container.xml and the
+    necessary OPF files.
     
     Epub has been written as a context-manager, and is therefore compatible
     with the `with` statement introduced in Python 2.6.
+    
+    If `workers` is greater than 1, members are compressed concurrently on
+    a pool of that many threads. Members are still written to the archive in
+    the order they were added, and the archive is byte-for-byte the same as
+    one written with a single worker.
+    
+    `policy` is an archive.CompressionPolicy deciding how each member is
+    compressed; it defaults to archive.DEFAULT_POLICY, which stores images
+    and other already-compressed media. archive.FAST_POLICY and
+    archive.SMALLEST_POLICY are also provided.
+    
+    `memory_budget` caps the bytes of member data which Epub holds while it
+    is waiting to be compressed or written. With workers, writestr data
+    which would take it over budget is spooled to a temporary file (in
+    `spill_dir`, by default the system's temporary directory) and
+    compressed into the archive in its turn; without workers, so is any
+    member larger than the budget. Either way, the archive is identical to
+    one built without a budget. Files passed to write()
+    which do not fit are compressed straight from disk. `peak_buffered`
+    records the most bytes held at once, and `spilled` the total bytes
+    spooled to disk. Documents written with open_entry, such as by
+    Publication.write_opf and TableOfContents.write_ncx, are compressed as
+    they are written and are never buffered.
+    
+    If a cache.BlobCache is provided as `cache`, members which were
+    compressed with the same settings in a previous build are copied from
+    the cache instead of being compressed again.
+    
+    `path` may be a path, or a file-like object opened for writing bytes.
+    The file-like object need not be seekable: each member is sent to it as
+    soon as it is written, and members from open_entry carry their CRC and
+    sizes in data descriptors, so an epub can be streamed to a pipe, socket
+    or HTTP response without a temporary file.
+    
+    If `reproducible` is true, every member is given the same timestamp
+    (see archive.reproducible_date_time) and fixed permissions, so that
+    adding the same content in the same order always produces an identical
+    archive. Use it together with the `stable_ids` options of Publication
+    and TableOfContents.
     """
     
-    def __init__(self, path):
-        self.file = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
-        # path -> content
-        self.contents = {}
+    def __init__(self, path, workers=None, policy=None, cache=None,
+            reproducible=False, memory_budget=None, spill_dir=None):
+        self.seekable = True
+        if hasattr(path, 'write') and not archive.is_seekable(path):
+            self.seekable = False
+            try:
+                path.tell()
+            except (AttributeError, IOError, OSError):
+                path = archive.PositionTracker(path)
+        self.file = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED,
+                allowZip64=True)
+        self.policy = policy or archive.DEFAULT_POLICY
+        self.cache = cache
+        self._compress = archive.compress if cache is None else cache.compress
         
         # If it's a new file, we add the necessary first file:
+        self.date_time = None
+        if reproducible:
+            self.date_time = archive.reproducible_date_time()
         mtzi = zipfile.ZipInfo('mimetype')
         mtzi.compress_type = zipfile.ZIP_STORED
-        self.file.writestr(mtzi, 'application/epub+zip')
+        self._prepare_info(mtzi)
+        self._write_compressed(mtzi,
+                archive.compress(MIMETYPE, zipfile.ZIP_STORED))
+
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.buffered = 0
+        self.peak_buffered = 0
+        self.spilled = 0
+        # The sizes of the most recently added members which may still be
+        # pending, in order. These count towards `buffered` until enough
+        # later members have been added to force them out, so whether a
+        # member fits in the budget depends only on the order of calls,
+        # never on how quickly the workers compress:
+        self._held = collections.deque()
+
+        self._entry = None
+        self._pool = None
+        # (zinfo, result) for members which have not yet been written, in
+        # archive order:
+        self._pending = collections.deque()
+        self._max_pending = 0
+        if workers is not None and workers > 1:
+            from multiprocessing.pool import ThreadPool
+            self._pool = ThreadPool(workers)
+            # Bound the number of compressed members held in memory:
+            self._max_pending = workers * 2
     
+    @staticmethod
+    def open(path_or_stream, iterparse=False):
+        """Open an existing epub file for reading, returning an EpubReader."""
+        return EpubReader(path_or_stream, iterparse)
+
+    @classmethod
+    def update(cls, previous, path, changed=None, removed=(),
+            publication=None, toc=None, **kwargs):
+        """
+        Write a new epub to `path`, based on the existing epub `previous` (a
+        path, file-like object or EpubReader), without recompressing the
+        members which have not changed.
+        
+        `changed` maps archive paths to their new content. Members which
+        already exist in `previous` are replaced in place; others are added
+        at the end of the archive. Members whose paths are in `removed` are
+        left out. If `publication` or `toc` is provided, it is written over
+        the OPF or NCX file of `previous`. All other members are copied,
+        still compressed, from `previous`.
+        
+        The NCX file is the one in the manifest of `publication` if given,
+        or of `previous` otherwise; ValueError is raised before anything is
+        written if `toc` is given and that manifest has no NCX file.
+        
+        If `path` is a path, the new epub is written to a temporary file
+        beside it, which only replaces `path` once it is complete. `path` may
+        therefore be the same file as `previous`, and is left untouched if
+        the update fails.
+        
+        Any other keyword arguments are passed to the Epub constructor.
+        """
+        changed = dict(changed or {})
+        removed = set(removed)
+        temp_path = None
+        if not hasattr(path, 'write'):
+            temp_path = '%s.%d.tmp' % (path, os.getpid())
+        reader = (previous if isinstance(previous, EpubReader)
+                else EpubReader(previous))
+        try:
+            try:
+                if publication is not None:
+                    changed[reader.opf_path] = publication.as_opf()
+                if toc is not None:
+                    ncx_path = cls._ncx_path(reader, publication)
+                    changed[ncx_path] = toc.to_ncx()
+                with cls(temp_path or path, **kwargs) as book:
+                    for archive_path in reader.namelist():
+                        if (archive_path == 'mimetype'
+                                or archive_path in removed):
+                            continue
+                        if archive_path in changed:
+                            book.writestr(archive_path,
+                                    changed.pop(archive_path))
+                        else:
+                            book.copy_member(reader, archive_path)
+                    for archive_path in sorted(changed):
+                        book.writestr(archive_path, changed[archive_path])
+            finally:
+                if reader is not previous:
+                    reader.close()
+            if temp_path is not None:
+                if os.name == 'nt' and os.path.exists(path):
+                    # Windows will not rename over an existing file:
+                    os.remove(path)
+                os.rename(temp_path, path)
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def _ncx_path(reader, publication):
+        """
+        Return the archive path of the NCX file in `publication`, or in the
+        publication of the EpubReader `reader` if `publication` is None.
+        """
+        ncx_item = (publication or reader.publication).get_ncx_item()
+        if ncx_item is None:
+            raise ValueError("Cannot write a toc to an epub with no NCX file "
+                    "in its manifest")
+        return reader.item_path(ncx_item.href)
+
+    def copy_member(self, reader, archive_path):
+        """
+        Copy the member at `archive_path` from the EpubReader `reader`
+        without decompressing and recompressing it.
+        """
+        self._check_no_entry()
+        zinfo, data = reader.read_compressed(archive_path)
+        zinfo = copy.copy(zinfo)
+        # The CRC and sizes are always written in the local header:
+        zinfo.flag_bits &= ~0x08
+        self._prepare_info(zinfo)
+        if not self._fits(len(data)):
+            self._flush_pending()
+        self._hold(len(data))
+        self._pending.append((zinfo, _Ready((zinfo.CRC, zinfo.file_size,
+                zinfo.compress_type, data))))
+        self._flush_pending(self._max_pending)
+
     def write(self, path, archive_path=None):
         """Write the real file at `path` into the archive at `archive_path`."""
-        self.file.write(path, archive_path)
+        zinfo = archive.file_info(path, archive_path)
+        with open(path, 'rb') as real_file:
+            size = os.fstat(real_file.fileno()).st_size
+            if size > STREAM_THRESHOLD:
+                with self._open_entry(zinfo) as entry:
+                    shutil.copyfileobj(real_file, entry)
+            elif not self._fits(size):
+                # The file is already on disk, so needs no spooling:
+                self._check_no_entry()
+                self._flush_pending()
+                self._prepare_info(zinfo)
+                _Spilled(real_file).write_to(self.file, zinfo,
+                        self.policy.settings(zinfo.filename), self.spill_dir)
+            else:
+                self._add(zinfo, real_file.read())
         
     def writestr(self, archive_path, fbytes):
-        """Create a file in the archive with fbytes as content."""
-        self.file.writestr(archive_path, fbytes)
+        """
+        Create a file in the archive with fbytes as content. Unicode content
+        is encoded as UTF-8.
+        """
+        if not isinstance(fbytes, bytes):
+            fbytes = fbytes.encode('utf-8')
+        self._add(archive.member_info(archive_path), fbytes)
+
+    def open_entry(self, archive_path):
+        """
+        Return a writable file-like object (an archive.EntryWriter) which
+        compresses whatever is written to it into the member at
+        `archive_path` as it arrives. It must be closed, or used as a
+        context-manager, before anything else is added to the archive.
+        """
+        return self._open_entry(archive.member_info(archive_path))
+
+    def namelist(self):
+        """
+        Return the paths of all members added to the archive so far, in
+        archive order, including any still being compressed or written.
+        """
+        names = [zinfo.filename for zinfo in self.file.filelist]
+        names.extend(zinfo.filename for zinfo, _ in self._pending)
+        if self._entry is not None and not self._entry.closed:
+            names.append(self._entry.name)
+        return names
+
+    def validate(self, container, publication, toc=None):
+        """
+        Check the members added so far against `container`, `publication`
+        and `toc`, returning a list of validate.ValidationErrors.
+        """
+        return validate.validate(self.namelist(), container, publication,
+                toc)
+
+    def _open_entry(self, zinfo):
+        """Return an archive.EntryWriter for the member described by zinfo."""
+        self._check_no_entry()
+        self._flush_pending()
+        self._prepare_info(zinfo)
+        self._entry = self._entry_writer(zinfo)
+        return self._entry
+
+    def _entry_writer(self, zinfo):
+        """Return an EntryWriter using the policy's settings for zinfo."""
+        zinfo.compress_type, level = self.policy.settings(zinfo.filename)
+        return archive.EntryWriter(self.file, zinfo, level, self.seekable)
+
+    def _prepare_info(self, zinfo):
+        """Apply archive-wide settings to a new member's zinfo."""
+        if self.date_time is not None:
+            archive.make_reproducible(zinfo, self.date_time)
+
+    def _check_no_entry(self):
+        """Raise a RuntimeError if an entry from open_entry is still open."""
+        if self._entry is not None and not self._entry.closed:
+            raise RuntimeError("Entry '%s' must be closed before anything "
+                    "else is written." % self._entry.name)
+
+    def _add(self, zinfo, fbytes):
+        """
+        Compress `fbytes` and write it to the archive as the member described
+        by `zinfo`, either immediately or once earlier members are written.
+        """
+        self._check_no_entry()
+        self._prepare_info(zinfo)
+        size = len(fbytes)
+        if self._pool is None:
+            if self.memory_budget is not None and size > self.memory_budget:
+                self._spill(fbytes).write_to(self.file, zinfo,
+                        self.policy.settings(zinfo.filename), self.spill_dir)
+                return
+            args = ((self._compress, zinfo.filename, fbytes)
+                    + self.policy.settings(zinfo.filename))
+            self._hold(size)
+            try:
+                self._write_compressed(zinfo, _timed_compress(*args))
+            finally:
+                self._release(0)
+        elif not self._fits(size):
+            self._hold(0)
+            self._pending.append((zinfo, self._spill(fbytes)))
+            self._flush_pending(self._max_pending)
+        else:
+            args = ((self._compress, zinfo.filename, fbytes)
+                    + self.policy.settings(zinfo.filename))
+            self._hold(size)
+            self._pending.append((zinfo,
+                    self._pool.apply_async(_timed_compress, args)))
+            self._flush_pending(self._max_pending)
+
+    def _spill(self, fbytes):
+        """Spool `fbytes` to a temporary file, returning a _Spilled."""
+        spill = tempfile.TemporaryFile(dir=self.spill_dir)
+        try:
+            spill.write(fbytes)
+            spill.seek(0)
+        except:
+            spill.close()
+            raise
+        self.spilled += len(fbytes)
+        return _Spilled(spill)
+
+    def _fits(self, size):
+        """Return True if `size` more bytes may be held within budget."""
+        return (self.memory_budget is None
+                or self.buffered + size <= self.memory_budget)
+
+    def _hold(self, size):
+        """Account for a new member holding `size` bytes in memory."""
+        self._held.append(size)
+        self.buffered += size
+        if self.buffered > self.peak_buffered:
+            self.peak_buffered = self.buffered
+
+    def _release(self, limit):
+        """
+        Stop counting all but the `limit` most recently added members, once
+        no more than `limit` members can be pending.
+        """
+        held = self._held
+        while len(held) > limit:
+            self.buffered -= held.popleft()
+
+    def _flush_pending(self, limit=0):
+        """
+        Write completed compressions to the archive in order, waiting for
+        them until no more than `limit` remain pending.
+        """
+        pending = self._pending
+        while pending and (len(pending) > limit or pending[0][1].ready()):
+            zinfo, result = pending.popleft()
+            if isinstance(result, _Spilled):
+                result.write_to(self.file, zinfo,
+                        self.policy.settings(zinfo.filename), self.spill_dir)
+            else:
+                self._write_compressed(zinfo, result.get())
+        self._release(limit)
+
+    def _write_compressed(self, zinfo, compressed):
+        """Write a (CRC, size, compress_type, bytes) archive.compress result."""
+        archive.write_compressed(self.file, zinfo, *compressed)
     
     def __enter__(self):
         return self
@@ -65,9 +416,231 @@ class Epub(object):
 
     def close(self):
         """Close and finalise the open Epub file."""
+        try:
+            if self._entry is not None:
+                self._entry.close()
+            self._flush_pending()
+        finally:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+            self.file.close()
+
+
+class EpubReader(object):
+    """
+    Provides read access to an existing epub file.
+    
+    Only the zip archive's central directory is read when the EpubReader is
+    created. The container.xml, OPF and NCX documents are each parsed the
+    first time the `container`, `publication` or `toc` attribute is
+    accessed, and other members are only read when they are requested with
+    open() or read(); nothing is extracted to disk.
+    
+    If `iterparse` is true, the OPF and NCX documents are parsed
+    incrementally as they are streamed from the archive, using
+    Publication.iterparse and TableOfContents.iterparse, so their lxml trees
+    are never held in memory as a whole.
+    
+    Like Epub, EpubReader is a context-manager.
+    """
+    
+    def __init__(self, path_or_stream, iterparse=False):
+        self.file = zipfile.ZipFile(path_or_stream, 'r')
+        self.iterparse = iterparse
+        self._container = None
+        self._publication = None
+        self._toc = None
+
+    def namelist(self):
+        """Return the paths of all members of the archive."""
+        return self.file.namelist()
+
+    def open(self, archive_path):
+        """
+        Return a file-like object which streams the content of the member at
+        `archive_path`, decompressing it as it is read.
+        """
+        return self.file.open(archive_path)
+
+    def read(self, archive_path):
+        """Return the content of the member at `archive_path` as bytes."""
+        return self.file.read(archive_path)
+
+    def read_compressed(self, archive_path):
+        """
+        Return a tuple of (zipfile.ZipInfo, bytes) for the member at
+        `archive_path`, where bytes is the member's data exactly as it is
+        stored in the archive, without decompressing it.
+        """
+        zinfo = self.file.getinfo(archive_path)
+        fp = self.file.fp
+        fp.seek(zinfo.header_offset)
+        header = struct.unpack(zipfile.structFileHeader,
+                fp.read(zipfile.sizeFileHeader))
+        if header[0] != zipfile.stringFileHeader:
+            raise zipfile.BadZipfile(
+                    "Bad local file header for '%s'" % archive_path)
+        # Skip the filename and extra field:
+        fp.seek(header[-2] + header[-1], 1)
+        return zinfo, fp.read(zinfo.compress_size)
+
+    @property
+    def container(self):
+        """The Container parsed from META-INF/container.xml."""
+        if self._container is None:
+            stream = self.open(CONTAINER_PATH)
+            try:
+                self._container = Container(stream)
+            finally:
+                stream.close()
+        return self._container
+
+    @property
+    def opf_path(self):
+        """The archive path of the publication's OPF file."""
+        return self.container.rootfiles[0][0].lstrip('/')
+
+    @property
+    def publication(self):
+        """The Publication parsed from the epub's OPF file."""
+        if self._publication is None:
+            stream = self.open(self.opf_path)
+            try:
+                if self.iterparse:
+                    self._publication = Publication.iterparse(stream)
+                else:
+                    self._publication = Publication.from_file(stream)
+            finally:
+                stream.close()
+        return self._publication
+
+    @property
+    def ncx_path(self):
+        """
+        The archive path of the publication's NCX file, or None if the
+        publication's manifest does not include one.
+        """
+        ncx_item = self.publication.get_ncx_item()
+        if ncx_item is None:
+            return None
+        return self.item_path(ncx_item.href)
+
+    @property
+    def toc(self):
+        """
+        The TableOfContents parsed from the epub's NCX file, or None if the
+        publication's manifest does not include one.
+        """
+        if self._toc is None:
+            ncx_path = self.ncx_path
+            if ncx_path is not None:
+                stream = self.open(ncx_path)
+                try:
+                    if self.iterparse:
+                        self._toc = TableOfContents.iterparse(stream)
+                    else:
+                        self._toc = TableOfContents.from_file(stream)
+                finally:
+                    stream.close()
+        return self._toc
+
+    def item_path(self, href):
+        """
+        Return the archive path of the manifest item `href`, which is
+        relative to the location of the OPF file.
+        """
+        return posixpath.normpath(
+                posixpath.join(posixpath.dirname(self.opf_path), href))
+
+    def validate(self):
+        """
+        Check the epub's container, OPF and NCX files and its members
+        against each other, returning a list of validate.ValidationErrors.
+        """
+        return validate.validate_reader(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        self.close()
+        # Any exception will be re-raised:
+        return False
+
+    def close(self):
+        """Close the underlying archive."""
         self.file.close()
 
 
+class _Ready(object):
+    """
+    Stands in for a multiprocessing AsyncResult when a member's compressed
+    data is already available.
+    """
+    def __init__(self, value):
+        self.value = value
+
+    def ready(self):
+        return True
+
+    def get(self):
+        return self.value
+
+
+class _Spilled(object):
+    """
+    Stands in for a multiprocessing AsyncResult for a member whose data has
+    been spooled to a temporary file, to be compressed when it is written.
+    """
+    def __init__(self, spill):
+        self.spill = spill
+
+    def ready(self):
+        return True
+
+    def write_to(self, zfile, zinfo, settings, spill_dir):
+        """
+        Compress the spooled data with the policy `settings`, exactly as
+        archive.compress would, and write it to `zfile`.
+        """
+        compressed = None
+        try:
+            compressed = archive.compress_file(self.spill, *settings,
+                    spill_dir=spill_dir)
+            archive.write_compressed_file(zfile, zinfo, *compressed)
+        finally:
+            if compressed is not None:
+                compressed[3].close()
+            self.spill.close()
+
+
+def _timed_compress(compress, archive_path, fbytes, compress_type, level):
+    """
+    Call `compress` with the remaining arguments, reporting an
+    archive.compress instrumentation event for the member at `archive_path`.
+    """
+    started = instrument.start()
+    result = compress(fbytes, compress_type, level)
+    instrument.emit('archive.compress', started, archive_path, len(fbytes),
+            len(result[3]))
+    return result
+
+
+def release_element(element):
+    """
+    Free an element which has been fully processed during an
+    etree.iterparse, along with any preceding siblings, so that memory use
+    stays bounded however large the document is.
+    """
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
 def random_id(length=8, id_components=ID_COMPONENTS):
     """
     Generate a random ID string from the string provided as id_components.
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+Provides AsyncEpub, a variant of `epub.format.Epub` for use from asyncio
+applications, such as web services which generate epub files on request.
+
+This module requires asyncio, which is not available on Python 2. It is
+written without async/await syntax, so that the rest of the package still
+compiles there; its methods return asyncio Futures, which may be awaited.
+"""
+
+import asyncio
+import threading
+
+from epub.format import Epub
+
+__all__ = ['AsyncEpub']
+
+
+class _ChunkBuffer(object):
+    """
+    A write-only, non-seekable file-like object which Epub writes to on a
+    worker thread, and from which AsyncEpub collects the written bytes on
+    the event loop's thread.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        with self._lock:
+            self._chunks.append(bytes(data))
+            self._position += len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """Return, and forget, everything written since the last call."""
+        with self._lock:
+            data = b''.join(self._chunks)
+            del self._chunks[:]
+        return data
+
+
+class AsyncEpub(object):
+    """
+    Writes an epub file to an asyncio stream, such as an
+    asyncio.StreamWriter or anything else with a write(bytes) method and a
+    drain() coroutine.
+    
+    write(), writestr() and close() mirror the methods of Epub, but return
+    Futures. Each runs the underlying Epub method, including compression,
+    in `executor` (by default, the event loop's default executor), so the
+    event loop is never blocked. The archive bytes produced by each call are
+    written to `writer`, and drained, before its Future completes. Calls are
+    carried out in the order they are made, even if they are not awaited
+    one at a time.
+    
+    AsyncEpub supports `async with`, closing the archive on exit. Other
+    keyword arguments are passed to the Epub constructor.
+    """
+
+    def __init__(self, writer, loop=None, executor=None, **kwargs):
+        self.writer = writer
+        self.loop = loop or asyncio.get_event_loop()
+        self.executor = executor
+        self._buffer = _ChunkBuffer()
+        self._epub = Epub(self._buffer, **kwargs)
+        # The Future of the most recent call:
+        self._tail = None
+
+    def write(self, path, archive_path=None):
+        """Write the real file at `path` into the archive at `archive_path`."""
+        return self._schedule(self._epub.write, path, archive_path)
+
+    def writestr(self, archive_path, fbytes):
+        """Create a file in the archive with fbytes as content."""
+        return self._schedule(self._epub.writestr, archive_path, fbytes)
+
+    def close(self):
+        """Close and finalise the archive, writing its central directory."""
+        return self._schedule(self._epub.close)
+
+    def __aenter__(self):
+        started = self.loop.create_future()
+        # Send the mimetype member, written by the Epub constructor:
+        self._forward(started, self)
+        return started
+
+    def __aexit__(self, _type, value, traceback):
+        closed = self.loop.create_future()
+        def finish(future):
+            _copy_outcome(future, closed, False)
+        self.close().add_done_callback(finish)
+        return closed
+
+    def _schedule(self, method, *args):
+        """
+        Return a Future for calling `method` in the executor, once every
+        earlier call has completed, and forwarding the bytes it produces.
+        """
+        result = self.loop.create_future()
+        previous = self._tail
+        self._tail = result
+
+        def run(_=None):
+            self.loop.run_in_executor(self.executor, method, *args
+                    ).add_done_callback(finished)
+
+        def finished(future):
+            if future.cancelled() or future.exception() is not None:
+                _copy_outcome(future, result)
+            else:
+                self._forward(result, future.result())
+
+        if previous is None or previous.done():
+            run()
+        else:
+            previous.add_done_callback(run)
+        return result
+
+    def _forward(self, result, value):
+        """
+        Write any new archive bytes to the writer, and complete `result`
+        with `value` once the writer has drained.
+        """
+        data = self._buffer.take()
+        if data:
+            self.writer.write(data)
+        drained = asyncio.ensure_future(self.writer.drain(), loop=self.loop)
+        drained.add_done_callback(
+                lambda future: _copy_outcome(future, result, value))
+
+
+def _copy_outcome(source, target, value=None):
+    """
+    Complete the Future `target` with the exception of the completed Future
+    `source`, or with `value` if it succeeded.
+    """
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(value)
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+
+"""
+Low-level helpers used by `epub.format.Epub` to compress members and write
+them into a zipfile.ZipFile.
+
+Compression is separated from writing so that members can be compressed on
+worker threads while still being written to the archive in a fixed order.
+"""
+
+import os
+import posixpath
+import shutil
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+
+from epub import instrument
+from epub.format.publication import MIME_MAP
+
+__all__ = ['CompressionPolicy', 'DEFAULT_POLICY', 'FAST_POLICY',
+        'SMALLEST_POLICY', 'EntryWriter', 'compress', 'compress_file',
+        'member_info', 'file_info', 'reproducible_date_time',
+        'make_reproducible', 'write_compressed', 'write_compressed_file',
+        'is_seekable', 'PositionTracker']
+
+# Size of the pieces in which members are streamed into or out of files:
+CHUNK_SIZE = 1024 * 1024
+
+# The timestamp given to every member of a reproducible archive, unless
+# SOURCE_DATE_EPOCH is set. This is the earliest time a zip file can record:
+REPRODUCIBLE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# General purpose flag indicating that a member's CRC and sizes follow its
+# data, in a data descriptor with this format:
+DATA_DESCRIPTOR_FLAG = 0x08
+DATA_DESCRIPTOR_FORMAT = '<4sLLL'
+DATA_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+
+# Media types whose content is already compressed, and which deflate can
+# barely shrink:
+PRECOMPRESSED_MEDIA_TYPES = frozenset([
+    'image/jpeg',
+    'image/png',
+    'image/gif',
+    'audio/mpeg',
+    'audio/mp4',
+    'video/mp4',
+    'application/zip',
+    'font/woff',
+    'font/woff2',
+])
+
+
+class CompressionPolicy(object):
+    """
+    Decides how each member of an archive is compressed, based on its media
+    type or file extension.
+    
+    `levels` maps media types (as found in publication.MIME_MAP) or file
+    extensions (without the leading '.') to a zlib compression level, or to
+    None if members of that type should be stored uncompressed. An extension
+    takes precedence over its media type. Members matching neither are
+    deflated at `default_level`.
+    """
+    
+    def __init__(self, default_level=zlib.Z_DEFAULT_COMPRESSION,
+            levels=None):
+        self.default_level = default_level
+        self.levels = dict(levels or {})
+
+    def level(self, archive_path):
+        """
+        Return the zlib compression level for the member at `archive_path`,
+        or None if it should be stored.
+        """
+        ext = posixpath.splitext(archive_path)[1][1:].lower()
+        if ext in self.levels:
+            return self.levels[ext]
+        return self.levels.get(MIME_MAP.get(ext), self.default_level)
+
+    def settings(self, archive_path):
+        """
+        Return a tuple of (compress_type, level) for the member at
+        `archive_path`, suitable for passing to `compress`.
+        """
+        level = self.level(archive_path)
+        if level is None:
+            return zipfile.ZIP_STORED, zlib.Z_DEFAULT_COMPRESSION
+        return zipfile.ZIP_DEFLATED, level
+
+
+# Stores already-compressed media, and deflates everything else at zlib's
+# default level:
+DEFAULT_POLICY = CompressionPolicy(levels=dict.fromkeys(
+        PRECOMPRESSED_MEDIA_TYPES))
+# Favours build speed over output size:
+FAST_POLICY = CompressionPolicy(1, dict.fromkeys(PRECOMPRESSED_MEDIA_TYPES))
+# Favours output size over build speed. Even already-compressed media is
+# deflated, although compress stores it if that turns out smaller:
+SMALLEST_POLICY = CompressionPolicy(9)
+
+
+def compress(data, compress_type=zipfile.ZIP_DEFLATED,
+        level=zlib.Z_DEFAULT_COMPRESSION):
+    """
+    Compress the bytes `data` as they would be stored in a zip archive.
+    Returns a tuple of (CRC, file_size, compress_type, compressed_bytes).
+    
+    If deflating `data` would not make it any smaller, it is stored instead
+    and the returned compress_type is ZIP_STORED.
+    
+    This is a pure function of its arguments, so it may be called from any
+    thread; zlib releases the GIL while it deflates.
+    """
+    crc = zlib.crc32(data) & 0xffffffff
+    if compress_type == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) < len(data):
+            return crc, len(data), compress_type, compressed
+    return crc, len(data), zipfile.ZIP_STORED, data
+
+
+def compress_file(source, compress_type=zipfile.ZIP_DEFLATED,
+        level=zlib.Z_DEFAULT_COMPRESSION, spill_dir=None):
+    """
+    Compress the content of the file-like object `source`, as `compress`
+    does, without holding it in memory. Deflated data is written to a
+    temporary file in `spill_dir`.
+    
+    Returns a tuple of (CRC, file_size, compress_type, fileobj,
+    compress_size), where fileobj is positioned at the start of the data to
+    store: the temporary file, or `source` itself if deflating would not
+    make it any smaller. The caller must close both.
+    """
+    crc = 0
+    size = 0
+    compressor = deflated = None
+    if compress_type == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        deflated = tempfile.TemporaryFile(dir=spill_dir)
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        if compressor is not None:
+            deflated.write(compressor.compress(chunk))
+    crc &= 0xffffffff
+    if compressor is not None:
+        deflated.write(compressor.flush())
+        compress_size = deflated.tell()
+        if compress_size < size:
+            deflated.seek(0)
+            return crc, size, compress_type, deflated, compress_size
+        deflated.close()
+    source.seek(0)
+    return crc, size, zipfile.ZIP_STORED, source, size
+
+
+def member_info(archive_path, date_time=None, compress_type=None):
+    """
+    Create a zipfile.ZipInfo for a regular file stored at `archive_path`.
+    
+    `date_time` defaults to the current local time.
+    """
+    if date_time is None:
+        date_time = time.localtime(time.time())[:6]
+    zinfo = zipfile.ZipInfo(archive_path, date_time)
+    zinfo.compress_type = (zipfile.ZIP_DEFLATED if compress_type is None
+            else compress_type)
+    zinfo.external_attr = 0o600 << 16     # ?rw-------
+    return zinfo
+
+
+def file_info(path, archive_path=None):
+    """
+    Create a zipfile.ZipInfo for the real file at `path`, named and
+    timestamped in the same way as zipfile.ZipFile.write would.
+    """
+    st = os.stat(path)
+    if archive_path is None:
+        archive_path = path
+    archive_path = os.path.normpath(os.path.splitdrive(archive_path)[1])
+    while archive_path[0] in (os.sep, os.altsep):
+        archive_path = archive_path[1:]
+    zinfo = member_info(archive_path, time.localtime(st.st_mtime)[:6])
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    return zinfo
+
+
+def is_seekable(fileobj):
+    """
+    Returns True if the file-like object `fileobj` supports seek() and
+    tell(), as zipfile needs to rewrite a member's header.
+    """
+    if hasattr(fileobj, 'seekable'):
+        try:
+            return fileobj.seekable()
+        except (IOError, OSError, ValueError):
+            return False
+    try:
+        fileobj.seek(fileobj.tell())
+    except (AttributeError, IOError, OSError):
+        return False
+    return True
+
+
+class PositionTracker(object):
+    """
+    Wraps a write-only, non-seekable file-like object, such as a pipe,
+    socket file or HTTP response, adding the tell() method zipfile needs
+    by counting the bytes written.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self._position = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self._position += len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        if hasattr(self.fileobj, 'flush'):
+            self.fileobj.flush()
+
+
+def _record_member(zfile, zinfo):
+    """
+    Add a member which has just been written to the directory of the
+    zipfile.ZipFile `zfile`.
+    """
+    zfile.filelist.append(zinfo)
+    zfile.NameToInfo[zinfo.filename] = zinfo
+    # Python 3's ZipFile writes its central directory at start_dir, which
+    # it advances after writing each member itself:
+    zfile.start_dir = zfile.fp.tell()
+
+
+def reproducible_date_time():
+    """
+    Return the timestamp to give every member of a reproducible archive:
+    the time in the SOURCE_DATE_EPOCH environment variable if it is set
+    (see https://reproducible-builds.org/specs/source-date-epoch/),
+    otherwise REPRODUCIBLE_DATE_TIME.
+    """
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if epoch:
+        return max(time.gmtime(int(epoch))[:6], REPRODUCIBLE_DATE_TIME)
+    return REPRODUCIBLE_DATE_TIME
+
+
+def make_reproducible(zinfo, date_time):
+    """
+    Replace the metadata of `zinfo` which depends on when and where an
+    archive was built with fixed values, and give it the timestamp
+    `date_time`.
+    """
+    zinfo.date_time = date_time
+    zinfo.create_system = 3               # Unix
+    zinfo.external_attr = 0o644 << 16     # ?rw-r--r--
+
+
+def write_compressed(zfile, zinfo, crc, file_size, compress_type, data):
+    """
+    Write a member which has already been compressed (see `compress`) to the
+    zipfile.ZipFile `zfile`, which must be open for writing.
+    """
+    started = instrument.start()
+    _write_header(zfile, zinfo, crc, file_size, compress_type, len(data))
+    zfile.fp.write(data)
+    _finish_member(zfile, zinfo, started)
+
+
+def write_compressed_file(zfile, zinfo, crc, file_size, compress_type,
+        fileobj, compress_size):
+    """
+    Write a member which has already been compressed to the file-like
+    object `fileobj` (see `compress_file`) to the zipfile.ZipFile `zfile`.
+    """
+    started = instrument.start()
+    _write_header(zfile, zinfo, crc, file_size, compress_type, compress_size)
+    shutil.copyfileobj(fileobj, zfile.fp, CHUNK_SIZE)
+    _finish_member(zfile, zinfo, started)
+
+
+def _write_header(zfile, zinfo, crc, file_size, compress_type,
+        compress_size):
+    """Fill in `zinfo` and write its local header to `zfile`."""
+    zinfo.CRC = crc
+    zinfo.compress_type = compress_type
+    zinfo.file_size = file_size
+    zinfo.compress_size = compress_size
+    zinfo.header_offset = zfile.fp.tell()
+    zip64 = (zinfo.file_size > zipfile.ZIP64_LIMIT
+            or zinfo.compress_size > zipfile.ZIP64_LIMIT)
+    zfile.fp.write(zinfo.FileHeader(zip64))
+
+
+def _finish_member(zfile, zinfo, started):
+    """Flush and record a member written since `started`."""
+    zfile.fp.flush()
+    _record_member(zfile, zinfo)
+    instrument.emit('archive.write', started, zinfo.filename,
+            zinfo.file_size, zinfo.compress_size)
+
+
+class EntryWriter(object):
+    """
+    A writable file-like object which compresses data into a single member
+    of a zipfile.ZipFile as it is written, so the member's content is never
+    held in memory as a whole.
+    
+    The member's local header is written when the EntryWriter is created.
+    If `seekable` is true, the header is rewritten with the member's CRC and
+    sizes when it is closed. Otherwise they are written in a data descriptor
+    following the member's data, so the archive may be streamed to a pipe or
+    socket. Nothing else may be written to the archive while an EntryWriter
+    is open.
+    
+    EntryWriter is a context-manager, and closes itself on exit. The
+    archive.write event it reports covers the whole time it is open.
+    """
+    
+    def __init__(self, zfile, zinfo, level=zlib.Z_DEFAULT_COMPRESSION,
+            seekable=True):
+        self.closed = False
+        self.seekable = seekable
+        self._started = instrument.start()
+        self.name = zinfo.filename
+        self._zfile = zfile
+        self._zinfo = zinfo
+        self._compressor = None
+        if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self._crc = 0
+        zinfo.CRC = zinfo.file_size = zinfo.compress_size = 0
+        if not seekable:
+            zinfo.flag_bits |= DATA_DESCRIPTOR_FLAG
+        zinfo.header_offset = zfile.fp.tell()
+        zfile.fp.write(zinfo.FileHeader(False))
+
+    def write(self, data):
+        """Compress `data` into the member. Unicode is encoded as UTF-8."""
+        if self.closed:
+            raise ValueError("I/O operation on closed EntryWriter.")
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self._crc = zlib.crc32(data, self._crc)
+        self._zinfo.file_size += len(data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._write_raw(data)
+
+    def _write_raw(self, data):
+        """Write already-compressed `data` to the archive."""
+        self._zinfo.compress_size += len(data)
+        self._zfile.fp.write(data)
+
+    def flush(self):
+        """Present for file-like compatibility; data is written on close."""
+        pass
+
+    def close(self):
+        """Finish the member and record it in the archive."""
+        if self.closed:
+            return
+        self.closed = True
+        zinfo = self._zinfo
+        if self._compressor is not None:
+            self._write_raw(self._compressor.flush())
+            self._compressor = None
+        zinfo.CRC = self._crc & 0xffffffff
+        if (zinfo.file_size > zipfile.ZIP64_LIMIT
+                or zinfo.compress_size > zipfile.ZIP64_LIMIT):
+            raise zipfile.LargeZipFile(
+                    "Streamed members cannot use ZIP64 extensions")
+        fp = self._zfile.fp
+        if self.seekable:
+            end = fp.tell()
+            fp.seek(zinfo.header_offset)
+            fp.write(zinfo.FileHeader(False))
+            fp.seek(end)
+        else:
+            fp.write(struct.pack(DATA_DESCRIPTOR_FORMAT,
+                    DATA_DESCRIPTOR_SIGNATURE, zinfo.CRC,
+                    zinfo.compress_size, zinfo.file_size))
+        fp.flush()
+        _record_member(self._zfile, zinfo)
+        instrument.emit('archive.write', self._started, zinfo.filename,
+                zinfo.file_size, zinfo.compress_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        self.close()
+        # Any exception will be re-raised:
+        return False
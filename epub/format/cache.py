@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""
+Provides BlobCache, an on-disk cache of compressed archive members which
+allows `epub.format.Epub` to skip compressing content it has compressed in
+a previous build.
+"""
+
+import collections
+import errno
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import zipfile
+
+from epub.format import archive
+
+__all__ = ['BlobCache']
+
+# Each cache file starts with the member's CRC, uncompressed size and
+# compress_type, followed by its compressed bytes:
+HEADER_FORMAT = '<LQH'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+class BlobCache(object):
+    """
+    A content-addressed cache of compressed member data, stored in
+    `directory`.
+    
+    Entries are keyed by a hash of the uncompressed content and the
+    compression settings, so a cached entry can be copied into an archive in
+    place of compressing the same content again. Stored members are not
+    cached, as storing them is no slower than reading them back. When the
+    cache grows beyond `max_size` bytes, the least-recently-used entries are
+    removed.
+    
+    `hits` and `misses` count the lookups made through compress(). BlobCache
+    may be used from several threads at once.
+    """
+    
+    def __init__(self, directory, max_size=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # path -> size, for every entry in the cache, from least to most
+        # recently used:
+        self._sizes = collections.OrderedDict()
+        self.size = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        entries = []
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+        # Entries' modification times record their use by earlier instances:
+        for _, path, size in sorted(entries):
+            self._sizes[path] = size
+            self.size += size
+
+    @staticmethod
+    def key(data, compress_type, level):
+        """Return the cache key for `data` compressed with these settings."""
+        digest = hashlib.sha1(data)
+        digest.update(struct.pack('<Hh', compress_type, level))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        """Return the path of the cache file for `key`."""
+        return os.path.join(self.directory, key[:2], key)
+
+    def compress(self, data, compress_type, level):
+        """
+        Return the same (CRC, file_size, compress_type, compressed_bytes)
+        tuple as archive.compress would, reading it from the cache if
+        possible, and storing it in the cache if not.
+        """
+        if compress_type == zipfile.ZIP_STORED:
+            return archive.compress(data, compress_type, level)
+        path = self._path(self.key(data, compress_type, level))
+        result = self._read(path)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                # Move the entry to the most recently used end:
+                if path in self._sizes:
+                    self._sizes[path] = self._sizes.pop(path)
+        if result is None:
+            result = archive.compress(data, compress_type, level)
+            self._store(path, result)
+        return result
+
+    def _read(self, path):
+        """Return the cached tuple stored at `path`, or None."""
+        try:
+            with open(path, 'rb') as cached:
+                blob = cached.read()
+        except IOError as err:
+            if err.errno == errno.ENOENT:
+                return None
+            raise
+        if len(blob) < HEADER_SIZE:
+            return None
+        # Mark the entry as recently used, for later instances:
+        os.utime(path, None)
+        crc, file_size, compress_type = struct.unpack(HEADER_FORMAT,
+                blob[:HEADER_SIZE])
+        return crc, file_size, compress_type, blob[HEADER_SIZE:]
+
+    def _store(self, path, result):
+        """Atomically write the archive.compress `result` to `path`."""
+        crc, file_size, compress_type, data = result
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+        handle, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(handle, 'wb') as out:
+                out.write(struct.pack(HEADER_FORMAT, crc, file_size,
+                        compress_type))
+                out.write(data)
+            os.rename(temp_path, path)
+        except:
+            os.unlink(temp_path)
+            raise
+        with self._lock:
+            self.size += HEADER_SIZE + len(data) - self._sizes.pop(path, 0)
+            self._sizes[path] = HEADER_SIZE + len(data)
+            if self.size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """
+        Remove least-recently-used entries until the cache fits in max_size.
+        Must be called with self._lock held.
+        """
+        while self.size > self.max_size and self._sizes:
+            path, size = self._sizes.popitem(last=False)
+            try:
+                os.unlink(path)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+            self.size -= size
@@ -5,15 +5,18 @@ Provides the `Container` class, which can be used to generate epub-compliant
 container.xml files.
 """
 
-import jinja2
-from lxml import etree
+import epub.format
+from epub import instrument, lazy
+
+etree = lazy.module('lxml.etree')
 
 __all__ = ['Container']
 
 NSMAP = { 'c': 'urn:oasis:names:tc:opendocument:xmlns:container' }
+ROOTFILE = '{%s}rootfile' % NSMAP['c']
 CONTAINER_XML_TEMPLATE = """<?xml version="1.0"  encoding="UTF-8"?>
 <container version="1.0"
-           xmlns="urn:oasis:names:tc:opendocument:xmlns:container"
+           xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
   <rootfiles>
     {%- for rf_path, media_type in rootfiles %}
     <rootfile full-path="{{rf_path}}"
@@ -28,7 +31,7 @@ class Container(object):
     a link to the rootfile (usually an OPF file)."""
     
     container_ns = "{urn:oasis:names:tc:opendocument:xmlns:container}"
-    tmpl = jinja2.Template(CONTAINER_XML_TEMPLATE)
+    tmpl = lazy.Template(CONTAINER_XML_TEMPLATE)
    
     def __init__(self, path_or_stream=None):
         """
@@ -59,19 +62,44 @@ class Container(object):
         instance.parse_tree(root)
         return instance
     
+    @classmethod
+    def iterparse(cls, path_or_stream):
+        """
+        Create a new Container, populated by incrementally parsing the
+        resource specified by `path_or_stream` (either a path to a file, or
+        a file-like object) without building a full lxml.etree document.
+        """
+        started = instrument.start()
+        path_or_stream = instrument.counting(started, path_or_stream)
+        instance = cls()
+        for _, rfile in etree.iterparse(path_or_stream, tag=ROOTFILE):
+            instance.rootfiles.append(
+                    (rfile.attrib['full-path'], rfile.attrib['media-type']))
+            epub.format.release_element(rfile)
+        instrument.emit('container.parse', started,
+                input_size=instrument.file_size(started, path_or_stream))
+        return instance
+
     def parse(self, path_or_stream):
         """
         Populate the Container using the XML contained in the resource
         specified by `path_or_stream` (either a path to a file, or a
         file-like object).
         """
+        started = instrument.start()
+        path_or_stream = instrument.counting(started, path_or_stream)
         self.parse_tree(etree.parse(path_or_stream))
+        instrument.emit('container.parse', started,
+                input_size=instrument.file_size(started, path_or_stream))
     
     def parse_string(self, xml_string):
         """
         Populate the Container by parsing the XML contained in `xml_string`.
         """
+        started = instrument.start()
         self.parse_tree(etree.fromstring(xml_string))
+        instrument.emit('container.parse', started,
+                input_size=len(xml_string))
         
     def parse_tree(self, root):
         """
@@ -93,4 +121,8 @@ class Container(object):
         Return a string containing XML in the epub standard's container.xml
         format.
         """
-        return self.tmpl.render(rootfiles=self.rootfiles)
\ No newline at end of file
+        started = instrument.start()
+        result = self.tmpl.render(rootfiles=self.rootfiles)
+        instrument.emit('container.render', started,
+                output_size=instrument.encoded_size(started, result))
+        return result
\ No newline at end of file
@@ -7,10 +7,12 @@ Provides the Publication class, which can be used to parse or generate
 epub-compliant OPF files.
 """
 
-import jinja2
-from lxml import etree
+import hashlib
 
 import epub.format
+from epub import instrument, lazy
+
+etree = lazy.module('lxml.etree')
 
 __all__ = ['Publication']
 
@@ -19,6 +21,8 @@ NSMAP = {
     'dc':'http://purl.org/dc/elements/1.1/',
 
 }
+OPF = '{%s}' % NSMAP['opf']
+DC = '{%s}' % NSMAP['dc']
 
 OPF_TEMPLATE = """<?xml version="1.0"?>
 <opf:package version="2.0" xmlns:opf="http://www.idpf.org/2007/opf"
@@ -46,6 +50,28 @@ OPF_TEMPLATE = """<?xml version="1.0"?>
 </opf:package>"""
 
 
+def _xpath(path):
+    """
+    Compile `path` once, on first use, for evaluation against OPF documents.
+    """
+    return lazy.XPath(path, namespaces=NSMAP, smart_strings=False)
+
+# Tags handled by Publication.iterparse:
+TAG_METADATA = OPF + 'metadata'
+TAG_ITEM = OPF + 'item'
+TAG_ITEMREF = OPF + 'itemref'
+
+# Expressions used by Publication.from_root:
+XPATH_METADATA = _xpath('/opf:package/opf:metadata')
+XPATH_TITLE = _xpath('dc:title/text()')
+XPATH_IDENTIFIER = _xpath('dc:identifier/text()')
+XPATH_AUTHOR = _xpath('dc:creator[@opf:role="aut"]/text()')
+XPATH_FILEAS = _xpath('dc:creator[@opf:role="aut"]/@opf:file-as')
+XPATH_LANGUAGE = _xpath('dc:language/text()')
+XPATH_ITEMS = _xpath('/opf:package/opf:manifest/opf:item')
+XPATH_SPINE_IDREFS = _xpath('/opf:package/opf:spine/opf:itemref/@idref')
+
+
 # Lookup for file-extension -> mime-type:
 MIME_MAP = {
     'html': 'application/xhtml+xml',
@@ -53,12 +79,30 @@ MIME_MAP = {
     'css': 'text/css',
     'png': 'image/png',
     'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
     'svg': 'image/svg',
     'ncx': 'application/x-dtbncx+xml',
     'txt': 'text/plain',
     'pdf': 'application/pdf',
+    'mp3': 'audio/mpeg',
+    'm4a': 'audio/mp4',
+    'mp4': 'video/mp4',
+    'zip': 'application/zip',
+    'woff': 'font/woff',
+    'woff2': 'font/woff2',
 }
 
+NCX_MEDIA_TYPE = MIME_MAP['ncx']
+
+
+# Media-types of 'content' documents, which belong in the spine:
+SPINE_MEDIA_TYPES = frozenset(['application/x-dtbook+xml',
+        'application/xhtml+xml', 'text/x-oeb1-document'])
+
+# The single shared copy of each media-type string used by ManifestItems:
+_MEDIA_TYPES = {}
+
 
 class Publication(object):
     """Encapsulates an OPF file, which describes the files that make up
@@ -68,23 +112,35 @@ class Publication(object):
     manifest, including images, css, etc.  The spine contains references to the
     'content' documents in the order that they should be displayed linearly."""
     
-    tmpl = jinja2.Template(OPF_TEMPLATE)
+    tmpl = lazy.Template(OPF_TEMPLATE)
     lang = 'en-US'
    
-    def __init__(self, unique_id, title, author, fileas):
+    def __init__(self, unique_id, title, author, fileas, stable_ids=False):
         """
         Create a Publication with the provided characteristics.
+        
+        If `stable_ids` is true, ids generated for manifest items are
+        derived from their hrefs rather than chosen at random, so the same
+        manifest always produces the same OPF file.
         """
+        self.stable_ids = stable_ids
         self.unique_id = unique_id
         self.title = title
         self.authors = [(author, fileas)]
         self.items = []
         self.spine_items = []
+        # Indexes over self.items, maintained by add_item:
+        self._items_by_id = {}
+        self._items_by_href = {}
     
     @property
     def item_ids(self):
         """List of all item ids in the OPF file."""
         return [item.item_id for item in self.items] 
+
+    def has_item(self, item_id):
+        """Returns True if an item with the provided `item_id` exists."""
+        return item_id in self._items_by_id
    
     def generate_id(self):
         """
@@ -93,16 +149,51 @@ class Publication(object):
         """
         item_id = epub.format.random_id()
         # Just ensure id is unique - may save problems in rare occasions:
-        while item_id in self.item_ids:
-            item_id = epub.random_id()
+        while item_id in self._items_by_id:
+            item_id = epub.format.random_id()
         return item_id
    
+    def generate_stable_id(self, href):
+        """
+        Returns an id-string derived from `href`, suitable for use as a
+        unique-id for the manifest item with that href.
+        """
+        if not isinstance(href, bytes):
+            href = href.encode('utf-8')
+        base = 'item-' + hashlib.sha1(href).hexdigest()[:8]
+        item_id, suffix = base, 1
+        while item_id in self._items_by_id:
+            item_id = '%s-%d' % (base, suffix)
+            suffix += 1
+        return item_id
+
     def get_item(self, item_id):
         """
         Return the ManifestItem used internally to store manifest data for the
-        item with the provided `item_id`
+        item with the provided `item_id`. Raises IndexError if there is no
+        such item.
+        """
+        try:
+            return self._items_by_id[item_id]
+        except KeyError:
+            raise IndexError("No item with id '%s' in OPF file." % item_id)
+
+    def get_ncx_item(self):
+        """
+        Return the first ManifestItem with the NCX media-type, or None if
+        the manifest does not include one.
+        """
+        for item in self.items:
+            if item.media_type == NCX_MEDIA_TYPE:
+                return item
+        return None
+
+    def get_item_by_href(self, href):
+        """
+        Return the ManifestItem with the provided `href`, or None if no item
+        in the manifest refers to that path.
         """
-        return [i for i in self.items if i.item_id == item_id][0]
+        return self._items_by_href.get(href)
    
     def add_item(self, href, item_id=None, spine_item=None, media_type=None):
         """Adds an item to the OPF document's manifest.
@@ -116,12 +207,17 @@ class Publication(object):
         
         item = ManifestItem(href, item_id, spine_item, media_type)
         
-        item.ensure_valid(self.generate_id)
-        if item.item_id in self.item_ids:
+        if self.stable_ids:
+            item.ensure_valid(lambda: self.generate_stable_id(href))
+        else:
+            item.ensure_valid(self.generate_id)
+        if item.item_id in self._items_by_id:
             raise RuntimeError(
                     "Item with id '%s' is already in OPF file." % item_id)
         
         self.items.append(item)
+        self._items_by_id[item.item_id] = item
+        self._items_by_href.setdefault(item.href, item)
 
         if item.spine_item:
             self.spine_items.append(item)
@@ -134,56 +230,182 @@ class Publication(object):
         item.spine_item = True
         self.spine_items.append(item)
 
+    @classmethod
+    def from_file(cls, path_or_stream):
+        """
+        Create a new Publication parsed from the OPF file indicated by
+        `path_or_stream`, which should be a path to a file, or a file-like
+        object.
+        """
+        started = instrument.start()
+        path_or_stream = instrument.counting(started, path_or_stream)
+        tree = etree.parse(path_or_stream)
+        instrument.emit('opf.parse_xml', started,
+                input_size=instrument.file_size(started, path_or_stream))
+        return cls.from_root(tree)
+
+    @classmethod
+    def iterparse(cls, path_or_stream):
+        """
+        Create a new Publication by incrementally parsing the OPF file
+        indicated by `path_or_stream`, which should be a path to a file, or a
+        file-like object such as a member opened from a zip archive.
+        
+        ManifestItems are created as each manifest element is parsed, and
+        parsed elements are freed immediately, so the whole document is never
+        held in memory.
+        """
+        started = instrument.start()
+        result = None
+        # Manifest and spine entries which appear before the metadata:
+        pending = []
+        for _, element in etree.iterparse(path_or_stream,
+                tag=(TAG_METADATA, TAG_ITEM, TAG_ITEMREF)):
+            if element.tag == TAG_METADATA:
+                result = cls(XPATH_IDENTIFIER(element)[0],
+                        XPATH_TITLE(element)[0], XPATH_AUTHOR(element)[0],
+                        XPATH_FILEAS(element)[0])
+                result.lang = XPATH_LANGUAGE(element)[0]
+                for method, args in pending:
+                    method(result, *args)
+                pending = None
+            elif element.tag == TAG_ITEM:
+                attrib = element.attrib
+                args = (attrib['href'], attrib['id'], False,
+                        attrib['media-type'])
+                if result is None:
+                    pending.append((cls.add_item, args))
+                else:
+                    result.add_item(*args)
+            else:
+                if result is None:
+                    pending.append((cls.append_to_spine,
+                            (element.attrib['idref'],)))
+                else:
+                    result.append_to_spine(element.attrib['idref'])
+            epub.format.release_element(element)
+        if result is None:
+            raise RuntimeError("OPF file contains no metadata.")
+        instrument.emit('opf.from_root', started)
+        return result
+
     @classmethod
     def from_string(cls, xml_string):
         """
         Create a new Publication parsed from the provided `xml_string`.
         """
-        return cls.from_root(etree.fromstring(xml_string))
+        started = instrument.start()
+        root = etree.fromstring(xml_string)
+        instrument.emit('opf.parse_xml', started, input_size=len(xml_string))
+        return cls.from_root(root)
     
     @classmethod
     def from_root(cls, root):
         """
         Create a new Publication parsed from the provided lxml.etree document.
         """
-        def xpa(path, top=root):
-            "Utility function to run xpath with a useful namespace-map."
-            return top.xpath(path, namespaces=NSMAP)
-        
-        meta = xpa('/opf:package/opf:metadata')[0]
+        started = instrument.start()
+        meta = XPATH_METADATA(root)[0]
         
-        title = xpa('dc:title/text()', meta)[0]
-        unique_id = xpa('dc:identifier/text()', meta)[0]
-        author = xpa('dc:creator[@opf:role="aut"]/text()', meta)[0]
-        fileas = xpa('dc:creator[@opf:role="aut"]/@opf:file-as', meta)[0]
+        title = XPATH_TITLE(meta)[0]
+        unique_id = XPATH_IDENTIFIER(meta)[0]
+        author = XPATH_AUTHOR(meta)[0]
+        fileas = XPATH_FILEAS(meta)[0]
 
         result = cls(unique_id, title, author, fileas)
-        result.lang = xpa('dc:language/text()', meta)[0]
+        result.lang = XPATH_LANGUAGE(meta)[0]
         
-        for item in xpa('/opf:package/opf:manifest/opf:item'):
-            item_id = xpa('@id', item)[0]
-            href = xpa('@href', item)[0]
-            media_type = xpa('@media-type', item)[0]
-            result.add_item(href, item_id, False, media_type)
+        for item in XPATH_ITEMS(root):
+            attrib = item.attrib
+            result.add_item(attrib['href'], attrib['id'], False,
+                    attrib['media-type'])
         
-        for spine_id in xpa('/opf:package/opf:spine/opf:itemref/@idref'):
+        for spine_id in XPATH_SPINE_IDREFS(root):
             result.append_to_spine(spine_id)
         
+        instrument.emit('opf.from_root', started)
         return result
     
     def as_opf(self):
         """
         Return an XML string, in the epub OPF format.
         """
+        started = instrument.start()
         result = self.tmpl.render(pub=self)
+        instrument.emit('opf.render', started,
+                output_size=instrument.encoded_size(started, result))
         return result
 
+    def write_opf(self, output):
+        """
+        Serialise this Publication in the epub OPF format to `output`, which
+        may be a path or a file-like object opened for writing bytes.
+        
+        Unlike as_opf, the document is never held in memory as a whole: each
+        metadata, manifest and spine element is written to `output` as it is
+        generated.
+        """
+        started = instrument.start()
+        output = instrument.counting(started, output)
+        with etree.xmlfile(output, encoding='utf-8') as xf:
+            xf.write_declaration()
+            with xf.element(OPF + 'package', nsmap={'opf': NSMAP['opf']},
+                    version='2.0', attrib={'unique-identifier': 'bookid'}):
+                xf.write('\n    ')
+                with xf.element(OPF + 'metadata', nsmap={'dc': NSMAP['dc']}):
+                    _write_text_element(xf, DC + 'title', self.title)
+                    for author, fileas in self.authors:
+                        _write_text_element(xf, DC + 'creator', author, {
+                                OPF + 'file-as': fileas,
+                                OPF + 'role': 'aut'})
+                    _write_text_element(xf, DC + 'identifier',
+                            'urn:uuid:%s' % self.unique_id, {'id': 'bookid'})
+                    _write_text_element(xf, DC + 'language', self.lang)
+                    xf.write('\n    ')
+                xf.write('\n    ')
+                with xf.element(OPF + 'manifest'):
+                    for item in self.items:
+                        xf.write('\n        ')
+                        with xf.element(OPF + 'item', attrib={
+                                'id': item.item_id,
+                                'href': item.href,
+                                'media-type': item.media_type}):
+                            pass
+                    xf.write('\n    ')
+                xf.write('\n    ')
+                with xf.element(OPF + 'spine', toc='ncx'):
+                    for spine_item in self.spine_items:
+                        xf.write('\n        ')
+                        with xf.element(OPF + 'itemref',
+                                idref=spine_item.item_id):
+                            pass
+                    xf.write('\n    ')
+                xf.write('\n')
+        instrument.emit('opf.write', started,
+                output_size=instrument.file_size(started, output))
+
+
+def _write_text_element(xf, tag, text, attrib=None):
+    """
+    Write a single metadata element containing `text` to the lxml.etree
+    xmlfile `xf`.
+    """
+    xf.write('\n        ')
+    with xf.element(tag, attrib=attrib or {}):
+        xf.write(text)
+
 
 class ManifestItem(object):
     """
     Internal object used to validate and store information related to a single
     manifest item.
+    
+    ManifestItem uses __slots__, and shares a single copy of each distinct
+    media-type string between all instances, so each item costs 80 bytes
+    plus its href and id strings (measured on 64-bit CPython 2.7).
     """
+    __slots__ = ['href', 'item_id', 'media_type', 'spine_item']
+
     def __init__(self, href, item_id=None, spine_item=None, media_type=None):
         """
         Create a ManifestItem with the specified properties. Sensible defaults
@@ -197,14 +419,12 @@ class ManifestItem(object):
         self.href = href
         self.item_id = item_id
         
-        self.media_type = media_type
-        
         if media_type is None and '.' in href:
             ext = href[href.rfind('.')+1:]
             media_type = MIME_MAP.get(ext, None)
         if media_type is None:
             raise RuntimeError("Do not know media-type for file %s" % href)
-        self.media_type = media_type
+        self.media_type = _MEDIA_TYPES.setdefault(media_type, media_type)
         
         if spine_item is None and is_spine_mime(media_type):
             # NCX files shouldn't be added to the spine:
@@ -230,5 +450,4 @@ def is_spine_mime(media_type):
     type, such as HTML.  The result is not expected to be definitive,
     it's just a useful check to allow sensible behaviour in common cases.
     """
-    return media_type in ['application/x-dtbook+xml',
-            'application/xhtml+xml', 'text/x-oeb1-document']
\ No newline at end of file
+    return media_type in SPINE_MEDIA_TYPES
\ No newline at end of file
@@ -5,69 +5,80 @@ Provides TableOfContents, which can be used to generate or parse epub
 NCX files.
 """
 
-import jinja2
-from lxml import etree
+import hashlib
+from io import BytesIO
 
 import epub.format
+from epub import instrument, lazy
+
+etree = lazy.module('lxml.etree')
 
 __all__ = ['TableOfContents', 'NavPoint']
 
 NSMAP = {'ncx': 'http://www.daisy.org/z3986/2005/ncx/'}
-NCX_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
-<!DOCTYPE ncx PUBLIC "-//NISO//DTD ncx 2005-1//EN"
-"http://www.daisy.org/z3986/2005/ncx-2005-1.dtd">
-<ncx version="2005-1" xml:lang="en"
-        xmlns="http://www.daisy.org/z3986/2005/ncx/">
-  <head>
-<!-- The following four metadata items are required for all NCX documents,
-including those conforming to the relaxed constraints of OPS 2.0 -->
-
-    <meta name="dtb:uid" content="{{unique_id|e}}"/> <!-- same as in .opf -->
-    <meta name="dtb:depth" content="{{depth|e}}"/> <!-- 1 or higher -->
-    <meta name="dtb:totalPageCount" content="0"/> <!-- must be 0 -->
-    <meta name="dtb:maxPageNumber" content="0"/> <!-- must be 0 -->
-  </head>
-
-  <docTitle><text>{{docTitle|e}}</text></docTitle>
-  {% for author in docAuthors -%}
-  <docAuthor><text>{{author|e}}</text></docAuthor>
-  {% endfor %}
-  <navMap>
-    {%- macro render_nav_point(np) -%}
-    <navPoint {% if np.cls %}class="{{np.cls|e}}"{% endif %}
-              id="{{np.point_id|e}}" playOrder="{{np.play_order|e}}">
-      <navLabel><text>{{np.label|e}}</text></navLabel>
-      <content src="{{np.link|e}}"/>
-      {% for sp in np.nav_points %}
-        {{ render_nav_point(sp) }}
-      {%- endfor %}
-    </navPoint>
-    {%- endmacro -%}
-    {% for nav_point in nav_points %}
-    {{ render_nav_point(nav_point) }}
-    {%- endfor %}
-  </navMap>
-
-</ncx>
-"""
+NCX = '{%s}' % NSMAP['ncx']
+XMLNS = 'http://www.w3.org/XML/1998/namespace'
+XML_LANG = '{%s}lang' % XMLNS
+NCX_DOCTYPE = ('<!DOCTYPE ncx PUBLIC "-//NISO//DTD ncx 2005-1//EN"\n'
+        '"http://www.daisy.org/z3986/2005/ncx-2005-1.dtd">')
+
+def _xpath(path):
+    """
+    Compile `path` once, on first use, for evaluation against NCX documents.
+    """
+    return lazy.XPath(path, namespaces=NSMAP, smart_strings=False)
+
+# Tags handled by TableOfContents.iterparse:
+TAG_META = NCX + 'meta'
+TAG_TEXT = NCX + 'text'
+TAG_DOC_TITLE = NCX + 'docTitle'
+TAG_DOC_AUTHOR = NCX + 'docAuthor'
+TAG_NAV_MAP = NCX + 'navMap'
+TAG_NAV_POINT = NCX + 'navPoint'
+TAG_NAV_LABEL = NCX + 'navLabel'
+TAG_CONTENT = NCX + 'content'
+
+# Expressions used by TableOfContents.from_tree:
+XPATH_UID = _xpath('/ncx:ncx/ncx:head/ncx:meta[@name="dtb:uid"]/@content')
+XPATH_TITLE = _xpath('/ncx:ncx/ncx:docTitle/ncx:text/text()')
+XPATH_AUTHORS = _xpath('/ncx:ncx/ncx:docAuthor/ncx:text/text()')
+XPATH_NAV_POINTS = _xpath('/ncx:ncx/ncx:navMap/ncx:navPoint')
+XPATH_LABEL = _xpath('ncx:navLabel/ncx:text/text()')
+XPATH_LINK = _xpath('ncx:content/@src')
+
 
 class TableOfContents(object):
-    """An NCX file holds the table of contents for a publication."""
+    """An NCX file holds the table of contents for a publication.
     
-    tmpl = jinja2.Template(NCX_TEMPLATE)
+    NavPoints may be added by appending to the `nav_points` lists directly,
+    in which case depth() and play orders are recalculated from the whole
+    tree each time they are needed. Alternatively, the tree can be edited
+    with insert(), append(), move() and remove(). The first of these calls
+    indexes the tree, after which depth() and play_order() are answered from
+    cached values which each edit updates incrementally. Once indexed, call
+    reindex() after changing any nav_points list directly.
+    """
     
-    def __init__(self, unique_id, title, authors):
+    def __init__(self, unique_id, title, authors, stable_ids=False):
         """
         Create a TableOfContents with the provided properties.
         
         `unique_id` should be the same as that stored in the OPF file.
+        
+        If `stable_ids` is true, NavPoints created without a point_id are
+        given one derived from their label and link each time the NCX file
+        is written, rather than a random one, so the same tree always
+        produces the same NCX file. Ids are made unique with a numeric
+        suffix, as Publication.generate_stable_id does.
         """
+        self.stable_ids = stable_ids
         self.unique_id = unique_id
         self.title = title
         self.authors = ([authors] if isinstance(authors, basestring)
                 else authors)
         self.nav_points = []
-        self.npcount = 0
+        # Set by reindex, which insert/move/remove call if necessary:
+        self._indexed = False
 
     @classmethod
     def from_file(cls, path_or_stream):
@@ -76,15 +87,77 @@ class TableOfContents(object):
         path to a file, or should be a file-like object, and return a new
         TableOfContents for this data.
         """
-        return cls.from_tree(etree.parse(path_or_stream))
+        started = instrument.start()
+        path_or_stream = instrument.counting(started, path_or_stream)
+        tree = etree.parse(path_or_stream)
+        instrument.emit('ncx.parse_xml', started,
+                input_size=instrument.file_size(started, path_or_stream))
+        return cls.from_tree(tree)
     
+    @classmethod
+    def iterparse(cls, path_or_stream):
+        """
+        Incrementally parse the NCX file indicated by `path_or_stream`,
+        which should be a path to a file, or a file-like object such as a
+        member opened from a zip archive, and return a new TableOfContents
+        for this data.
+        
+        NavPoints are created as navPoint elements are parsed, and parsed
+        elements are freed immediately, so the whole document is never held
+        in memory.
+        """
+        started = instrument.start()
+        unique_id, title, authors = None, None, []
+        result = None
+        # The TableOfContents followed by each NavPoint being parsed:
+        stack = []
+        for event, element in etree.iterparse(path_or_stream,
+                events=('start', 'end'), tag=(TAG_META, TAG_TEXT,
+                    TAG_NAV_MAP, TAG_NAV_POINT, TAG_CONTENT)):
+            tag = element.tag
+            if event == 'start':
+                if tag == TAG_NAV_POINT:
+                    npoint = NavPoint(None, None, element.attrib['id'],
+                            element.get('class'))
+                    stack[-1].nav_points.append(npoint)
+                    stack.append(npoint)
+                elif tag == TAG_NAV_MAP:
+                    result = cls(unique_id, title, authors)
+                    stack.append(result)
+                continue
+            if tag == TAG_TEXT:
+                parent_tag = element.getparent().tag
+                if parent_tag == TAG_NAV_LABEL:
+                    stack[-1].label = element.text
+                elif parent_tag == TAG_DOC_TITLE:
+                    title = element.text.strip()
+                elif parent_tag == TAG_DOC_AUTHOR:
+                    authors.append(element.text.strip())
+                # The text is freed along with its navPoint or section.
+                continue
+            elif tag == TAG_CONTENT:
+                stack[-1].link = element.attrib['src']
+            elif tag == TAG_NAV_POINT:
+                stack.pop()
+            elif tag == TAG_META:
+                if element.get('name') == 'dtb:uid':
+                    unique_id = element.attrib['content'].strip()
+            epub.format.release_element(element)
+        if result is None:
+            raise RuntimeError("NCX file contains no navMap.")
+        instrument.emit('ncx.from_tree', started)
+        return result
+
     @classmethod
     def from_string(cls, xml_string):
         """
         Parse the provided NCX XML string, and return a new TableOfContents
         for this data.
         """
-        return cls.from_tree(etree.fromstring(xml_string))
+        started = instrument.start()
+        root = etree.fromstring(xml_string)
+        instrument.emit('ncx.parse_xml', started, input_size=len(xml_string))
+        return cls.from_tree(root)
     
     @classmethod
     def from_tree(cls, root):
@@ -92,89 +165,433 @@ class TableOfContents(object):
         Create a new TableOfContents from the NCX data stored under the 
         lxml.etree document `root`.
         """
-        def xpath(path, root=root):
-            "Utility method for executing xpath with a useful namespace-map."
-            return root.xpath(path, namespaces=NSMAP)
-        
-        unique_id = xpath(
-                '/ncx:ncx/ncx:head/ncx:meta[@name="dtb:uid"]/@content'
-                )[0].strip()
-        title = xpath('/ncx:ncx/ncx:docTitle/ncx:text/text()')[0].strip()
-        authors = [a.strip() for a in xpath(
-                '/ncx:ncx/ncx:docAuthor/ncx:text/text()')]
+        started = instrument.start()
+        unique_id = XPATH_UID(root)[0].strip()
+        title = XPATH_TITLE(root)[0].strip()
+        authors = [a.strip() for a in XPATH_AUTHORS(root)]
         
         result = cls(unique_id, title, authors)
         
-        def parse_nav_point(parent, node):
-            """
-            Internal method used to extract a NavPoint (and all contained
-            NavPoints, recursively) from an XML node.
-            """
-            label = xpath('ncx:navLabel/ncx:text/text()', node)[0]
-            link = xpath('ncx:content/@src', node)[0]
-            point_id = xpath('@id', node)[0]
-            clz = xpath('@class', node) or None
-            npoint = NavPoint(label, link, point_id, clz)
-            parent.nav_points.append(npoint)
-            
-            for sub_node in xpath('ncx:navPoint', node):
-                parse_nav_point(npoint, sub_node)
-            
-        for node in xpath('/ncx:ncx/ncx:navMap/ncx:navPoint'):
-            parse_nav_point(result, node)
+        # Walk the navMap without recursion, keeping an iterator over the
+        # child navPoint elements of each NavPoint being parsed:
+        stack = [(result, iter(XPATH_NAV_POINTS(root)))]
+        while stack:
+            parent, nodes = stack[-1]
+            for node in nodes:
+                npoint = NavPoint(XPATH_LABEL(node)[0], XPATH_LINK(node)[0],
+                        node.attrib['id'], node.get('class'))
+                parent.nav_points.append(npoint)
+                stack.append((npoint, node.iterchildren(NCX + 'navPoint')))
+                break
+            else:
+                stack.pop()
         
+        instrument.emit('ncx.from_tree', started)
         return result
     
     def depth(self):
         """
         Calculate the depth of this TableOfContents.
         """
-        if self.nav_points:
-            return max([np.depth() for np in self.nav_points])
-        else:
-            return 0
-    
-    def depth_first(self):
+        if self._indexed:
+            return len(self._level_counts)
+        return _max_depth(self.nav_points)
+
+    def reindex(self):
         """
-        Iterate through the NavPoints in this object in a depth-first order.
+        (Re)build the index used to maintain depth and play orders
+        incrementally, numbering every NavPoint.
         """
+        # Every NavPoint, in depth-first (play) order:
+        self._order = []
+        # NavPoint -> the NavPoint or TableOfContents which contains it:
+        self._parents = {}
+        # The number of NavPoints at each level, starting at 1:
+        self._level_counts = []
         for npoint in self.nav_points:
-            for innerpoint in npoint.depth_first():
-                yield innerpoint
+            self._parents[npoint] = self
+        for npoint, level in _walk_levels(self.nav_points, 1):
+            self._order.append(npoint)
+            for subpoint in npoint._nav_points or ():
+                self._parents[subpoint] = npoint
+            self._count_level(level, 1)
+        # play_order is correct for all NavPoints before this position:
+        self._numbered = 0
+        self._indexed = True
+        self._renumber()
+
+    def play_order(self, npoint):
+        """
+        Return the playOrder of `npoint`, which must be in this
+        TableOfContents, from the index.
+        """
+        self._ensure_index()
+        return self._position(npoint) + 1
+
+    def insert(self, parent, index, npoint):
+        """
+        Insert `npoint`, and any NavPoints it contains, at `index` in the
+        nav_points of `parent`, which is a NavPoint in this TableOfContents,
+        or None (or this TableOfContents) for the top level.
+        """
+        self._ensure_index()
+        if parent is None:
+            parent = self
+        siblings = parent.nav_points
+        index = len(siblings) if index is None else min(index, len(siblings))
+        position = self._insert_position(parent, index)
+        siblings.insert(index, npoint)
+        self._parents[npoint] = parent
+        level = self._level(npoint)
+        subtree = []
+        for subpoint, sublevel in _walk_levels([npoint], level):
+            subtree.append(subpoint)
+            for child in subpoint._nav_points or ():
+                self._parents[child] = subpoint
+            self._count_level(sublevel, 1)
+        self._order[position:position] = subtree
+        self._numbered = min(self._numbered, position)
+        return npoint
+
+    def append(self, parent, npoint):
+        """
+        Append `npoint` to the nav_points of `parent` (see insert).
+        """
+        return self.insert(parent, None, npoint)
+
+    def remove(self, npoint):
+        """
+        Remove `npoint`, and all the NavPoints it contains, from this
+        TableOfContents.
+        """
+        self._ensure_index()
+        position = self._position(npoint)
+        parent = self._parents[npoint]
+        size = 0
+        for subpoint, sublevel in _walk_levels([npoint], self._level(npoint)):
+            size += 1
+            self._count_level(sublevel, -1)
+            del self._parents[subpoint]
+        parent.nav_points.remove(npoint)
+        del self._order[position:position + size]
+        self._numbered = min(self._numbered, position)
+        npoint.play_order = -1
+
+    def move(self, npoint, parent, index=None):
+        """
+        Move `npoint`, and all the NavPoints it contains, to `index` in the
+        nav_points of `parent` (see insert). By default it is appended.
+        """
+        self._ensure_index()
+        ancestor = parent
+        while ancestor is not None and ancestor is not self:
+            if ancestor is npoint:
+                raise ValueError("Cannot move a NavPoint inside itself.")
+            ancestor = self._parents[ancestor]
+        self.remove(npoint)
+        self.insert(parent, index, npoint)
+
+    def _ensure_index(self):
+        """Index this TableOfContents if it is not already indexed."""
+        if not self._indexed:
+            self.reindex()
+
+    def _count_level(self, level, change):
+        """Add `change` to the number of NavPoints at `level`."""
+        counts = self._level_counts
+        while len(counts) < level:
+            counts.append(0)
+        counts[level - 1] += change
+        while counts and not counts[-1]:
+            counts.pop()
+
+    def _level(self, npoint):
+        """Return the level of `npoint`; top-level NavPoints are at 1."""
+        level = 0
+        while npoint is not self:
+            npoint = self._parents[npoint]
+            level += 1
+        return level
+
+    def _renumber(self):
+        """Bring play_order up to date for every indexed NavPoint."""
+        order = self._order
+        for position in range(self._numbered, len(order)):
+            order[position].play_order = position + 1
+        self._numbered = len(order)
 
-    def _number_nav_points(self):
+    def _position(self, npoint):
+        """Return the index of `npoint` in self._order."""
+        position = npoint.play_order - 1
+        if not (0 <= position < self._numbered
+                and self._order[position] is npoint):
+            if npoint not in self._parents:
+                raise ValueError("NavPoint is not in this TableOfContents.")
+            self._renumber()
+            position = npoint.play_order - 1
+        return position
+
+    def _insert_position(self, parent, index):
+        """
+        Return the position in self._order at which NavPoints inserted at
+        `index` in the nav_points of `parent` belong.
+        """
+        siblings = parent.nav_points
+        if index < len(siblings):
+            return self._position(siblings[index])
+        # Find the NavPoint which follows the whole of parent's subtree:
+        node = parent
+        while node is not self:
+            container = self._parents[node]
+            following = container.nav_points
+            after = following.index(node) + 1
+            if after < len(following):
+                return self._position(following[after])
+            node = container
+        return len(self._order)
+    
+    def depth_first(self):
         """
-        Used to number nav-points before writing out to NCX, which requires
-        this value to be set correctly on all navPoints.
+        Iterate through the NavPoints in this object in a depth-first order.
         """
-        for index, npoint in enumerate(self.depth_first()):
-            npoint.play_order = index + 1
+        return _depth_first(self.nav_points)
 
     def to_ncx(self):
         """
         Return an XML string conforming to the Daisy NCX standard, suitable
         for embedding in an epub file.
         """
-        self._number_nav_points()
-        result = self.tmpl.render(
-                docTitle=self.title,
-                docAuthors=self.authors,
-                nav_points=self.nav_points,
-                unique_id=self.unique_id,
-                depth=self.depth())
-        
+        started = instrument.start()
+        stream = BytesIO()
+        self._write_ncx(stream)
+        data = stream.getvalue()
+        result = data.decode('utf-8')
+        instrument.emit('ncx.render', started, output_size=len(data))
         return result
 
+    def write_ncx(self, output):
+        """
+        Serialise this TableOfContents as a Daisy NCX document to `output`,
+        which may be a path or a file-like object opened for writing bytes.
+        
+        play_order is assigned to each NavPoint as the navMap is written. The
+        tree is walked without recursion, so arbitrarily deep tables of
+        contents can be written.
+        """
+        started = instrument.start()
+        output = instrument.counting(started, output)
+        self._write_ncx(output)
+        instrument.emit('ncx.write', started,
+                output_size=instrument.file_size(started, output))
+
+    def _write_ncx(self, output):
+        """Implementation of write_ncx, without instrumentation."""
+        depth = self.depth()
+        with etree.xmlfile(output, encoding='utf-8') as xf:
+            xf.write_declaration()
+            xf.write_doctype(NCX_DOCTYPE)
+            # Binding the xml prefix explicitly stops lxml inventing one:
+            with xf.element(NCX + 'ncx',
+                    nsmap={None: NSMAP['ncx'], 'xml': XMLNS},
+                    version='2005-1', attrib={XML_LANG: 'en'}):
+                xf.write('\n  ')
+                with xf.element(NCX + 'head'):
+                    for name, content in [('dtb:uid', self.unique_id),
+                            ('dtb:depth', str(depth)),
+                            ('dtb:totalPageCount', '0'),
+                            ('dtb:maxPageNumber', '0')]:
+                        xf.write('\n    ')
+                        with xf.element(NCX + 'meta', name=name,
+                                content=content):
+                            pass
+                    xf.write('\n  ')
+                xf.write('\n  ')
+                _write_text(xf, NCX + 'docTitle', self.title)
+                for author in self.authors:
+                    xf.write('\n  ')
+                    _write_text(xf, NCX + 'docAuthor', author)
+                xf.write('\n  ')
+                with xf.element(NCX + 'navMap'):
+                    self._write_nav_map(xf)
+                    xf.write('\n  ')
+                xf.write('\n')
+
+    def _write_nav_map(self, xf):
+        """
+        Write all NavPoints to the lxml.etree xmlfile `xf`, numbering them
+        as they are written.
+        """
+        play_order = 0
+        taken = None
+        if self.stable_ids:
+            # Ids already taken, which derived ids must not duplicate:
+            taken = set(npoint.given_point_id
+                    for npoint in self.depth_first()
+                    if npoint.given_point_id is not None)
+        # One iterator per open navPoint element, plus one for the navMap:
+        stack = [iter(self.nav_points)]
+        elements = []
+        while stack:
+            for npoint in stack[-1]:
+                play_order += 1
+                npoint.play_order = play_order
+                if taken is not None and npoint.given_point_id is None:
+                    npoint._point_id = _stable_point_id(npoint, taken)
+                    npoint._id_generated = True
+                indent = '\n    ' + '  ' * len(elements)
+                attrib = {'id': npoint.point_id,
+                        'playOrder': str(play_order)}
+                if npoint.cls:
+                    attrib['class'] = npoint.cls
+                element = xf.element(NCX + 'navPoint', attrib=attrib)
+                xf.write(indent)
+                element.__enter__()
+                xf.write(indent + '  ')
+                _write_text(xf, NCX + 'navLabel', npoint.label)
+                xf.write(indent + '  ')
+                with xf.element(NCX + 'content', src=npoint.link):
+                    pass
+                elements.append((element, indent))
+                stack.append(iter(npoint._nav_points or ()))
+                break
+            else:
+                stack.pop()
+                if elements:
+                    element, indent = elements.pop()
+                    xf.write(indent)
+                    element.__exit__(None, None, None)
+
+
+def _stable_point_id(npoint, taken):
+    """
+    Return an id for `npoint` derived from its label and link which is not
+    in the set `taken`, and add it to `taken`.
+    """
+    content = u'%s\0%s' % (npoint.label, npoint.link)
+    base = 'navpoint-' + hashlib.sha1(content.encode('utf-8')).hexdigest()[:8]
+    point_id, suffix = base, 1
+    while point_id in taken:
+        suffix += 1
+        point_id = '%s-%d' % (base, suffix)
+    taken.add(point_id)
+    return point_id
+
+
+def _write_text(xf, tag, text):
+    """
+    Write an NCX element of type `tag`, wrapping a text element containing
+    `text`, to the lxml.etree xmlfile `xf`.
+    """
+    with xf.element(tag):
+        with xf.element(NCX + 'text'):
+            xf.write(text)
+
+
+def _depth_first(nav_points):
+    """
+    Iterate through `nav_points`, and all contained NavPoints, in a
+    depth-first order, without recursion.
+    """
+    stack = [iter(nav_points)]
+    while stack:
+        for npoint in stack[-1]:
+            yield npoint
+            stack.append(iter(npoint._nav_points or ()))
+            break
+        else:
+            stack.pop()
+
+
+def _walk_levels(nav_points, level):
+    """
+    Iterate through `nav_points`, and all contained NavPoints, in a
+    depth-first order, yielding each with its level, where `nav_points` are
+    at `level`.
+    """
+    stack = [iter(nav_points)]
+    while stack:
+        for npoint in stack[-1]:
+            yield npoint, level + len(stack) - 1
+            stack.append(iter(npoint._nav_points or ()))
+            break
+        else:
+            stack.pop()
+
+
+def _max_depth(nav_points):
+    """
+    Calculate the depth of the forest of NavPoints `nav_points`, without
+    recursion. An empty list has a depth of 0.
+    """
+    result = 0
+    stack = [(npoint, 1) for npoint in nav_points]
+    while stack:
+        npoint, depth = stack.pop()
+        if depth > result:
+            result = depth
+        for subpoint in npoint._nav_points or ():
+            stack.append((subpoint, depth + 1))
+    return result
+
 
 class NavPoint(object):
-    """Represents a navPoint node in the NCX file's navMap section."""
+    """
+    Represents a navPoint node in the NCX file's navMap section.
+    
+    NavPoint uses __slots__, and only creates its list of contained NavPoints
+    and its random point_id when they are first accessed, so a leaf NavPoint
+    costs 104 bytes plus its label and link strings (measured on 64-bit
+    CPython 2.7).
+    
+    A point_id which was generated rather than given is replaced by a
+    derived one when the NavPoint is written by a TableOfContents with
+    stable_ids.
+    """
+    __slots__ = ['label', 'link', 'play_order', 'cls', '_point_id',
+            '_id_generated', '_nav_points']
+
     def __init__(self, label, link, point_id=None, cls=None):
         self.label = label
         self.link = link
         self.play_order = -1
-        self.point_id = point_id or epub.format.random_id()
+        self._point_id = point_id or None
+        self._id_generated = False
         self.cls = cls
-        self.nav_points = []
+        self._nav_points = None
+
+    @property
+    def point_id(self):
+        """The id of this navPoint, generated randomly if not provided."""
+        if self._point_id is None:
+            self._point_id = epub.format.random_id()
+            self._id_generated = True
+        return self._point_id
+
+    @point_id.setter
+    def point_id(self, value):
+        self._point_id = value
+        self._id_generated = False
+
+    @property
+    def given_point_id(self):
+        """
+        The point_id given to or parsed for this navPoint, or None if it has
+        none, or one that was generated. Reading it never generates an id.
+        """
+        if self._id_generated:
+            return None
+        return self._point_id
+
+    @property
+    def nav_points(self):
+        """The list of NavPoints contained by this NavPoint."""
+        if self._nav_points is None:
+            self._nav_points = []
+        return self._nav_points
+
+    @nav_points.setter
+    def nav_points(self, value):
+        self._nav_points = value
     
     def depth_first(self):
         """
@@ -182,16 +599,12 @@ class NavPoint(object):
         depth-first order.
         """
         yield self
-        for subpoint in self.nav_points:
-            for innerpoint in subpoint.depth_first():
-                yield innerpoint
+        for innerpoint in _depth_first(self._nav_points or ()):
+            yield innerpoint
     
     def depth(self):
         """
         Calculate the depth of this sub-tree of NavPoints.
         """
-        if not self.nav_points:
-            return 1
-        else:
-            return 1 + max([np.depth() for np in self.nav_points])
+        return 1 + _max_depth(self._nav_points or ())
  
\ No newline at end of file
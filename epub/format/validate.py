@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+"""
+Checks that the parts of an epub agree with each other: that the container
+points at a rootfile in the archive, that every manifest item was written to
+the archive and every archive member is in the manifest, that the spine only
+refers to manifest items, and that every NCX link points at a manifest item.
+
+    errors = validate(book.namelist(), container, pub, toc)
+    for error in errors:
+        print('%s: %s' % (error.code, error.message))
+
+Each check is a lookup in a set or dict built once from the archive member
+list or the manifest, so validation takes time proportional to the size of
+the epub's metadata, and is cheap enough to run on every build. The content
+of documents is not inspected, so fragment identifiers in links are not
+checked.
+"""
+
+import collections
+import posixpath
+
+import epub.format
+from epub import lazy
+from epub.format import publication as opf
+
+etree = lazy.module('lxml.etree')
+
+__all__ = ['ValidationError', 'validate', 'validate_reader']
+
+# Error codes:
+NO_ROOTFILE = 'container.no_rootfile'
+MISSING_ROOTFILE = 'container.missing_rootfile'
+MISSING_ITEM = 'manifest.missing_item'
+DUPLICATE_HREF = 'manifest.duplicate_href'
+UNLISTED_MEMBER = 'archive.unlisted_member'
+MIMETYPE_NOT_FIRST = 'archive.mimetype_not_first'
+SPINE_NOT_IN_MANIFEST = 'spine.not_in_manifest'
+MISSING_METADATA = 'metadata.missing'
+DUPLICATE_ID = 'manifest.duplicate_id'
+INVALID_ITEM = 'manifest.invalid_item'
+UNKNOWN_MEDIA_TYPE = 'manifest.unknown_media_type'
+NO_NCX_ITEM = 'toc.no_ncx_item'
+DUPLICATE_POINT_ID = 'toc.duplicate_point_id'
+BROKEN_LINK = 'toc.broken_link'
+UNREADABLE = 'unreadable'
+
+# Members which are part of the container rather than the publication:
+CONTAINER_MEMBERS = frozenset(['mimetype'])
+CONTAINER_DIR = 'META-INF/'
+
+
+class ValidationError(collections.namedtuple('ValidationError',
+        ['code', 'path', 'message'])):
+    """
+    A single problem found by validate(). `code` is one of the error-code
+    constants in this module, and `path` is the archive path, manifest id or
+    navPoint id concerned.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return '%s: %s' % (self.code, self.message)
+
+
+def validate(members, container, publication, toc=None):
+    """
+    Check `container`, `publication` and `toc` (a TableOfContents, or None
+    if the epub has no NCX) against each other and against the archive
+    member paths `members`, given in archive order. Returns a list of
+    ValidationErrors, which is empty if no problems were found.
+    """
+    errors = []
+    members = list(members)
+    member_set = set(members)
+    if members and members[0] != 'mimetype':
+        errors.append(ValidationError(MIMETYPE_NOT_FIRST, members[0],
+                "The first member is '%s', not 'mimetype'." % members[0]))
+
+    if not container.rootfiles:
+        errors.append(ValidationError(NO_ROOTFILE, None,
+                "The container lists no rootfiles."))
+        return errors
+    for rootfile, media_type in container.rootfiles:
+        path = rootfile.lstrip('/')
+        if path not in member_set:
+            errors.append(ValidationError(MISSING_ROOTFILE, path,
+                    "Rootfile '%s' is not in the archive." % path))
+    opf_path = container.rootfiles[0][0].lstrip('/')
+    opf_dir = posixpath.dirname(opf_path)
+
+    # Archive path -> manifest item:
+    items_by_path = {}
+    for item in publication.items:
+        path = posixpath.normpath(posixpath.join(opf_dir, item.href))
+        if path in items_by_path:
+            errors.append(ValidationError(DUPLICATE_HREF, path,
+                    "Items '%s' and '%s' both refer to '%s'." % (
+                    items_by_path[path].item_id, item.item_id, path)))
+            continue
+        items_by_path[path] = item
+        if path not in member_set:
+            errors.append(ValidationError(MISSING_ITEM, path,
+                    "Item '%s' is in the manifest but '%s' is not in the "
+                    "archive." % (item.item_id, path)))
+    ncx_item = publication.get_ncx_item()
+    ncx_path = None
+    if ncx_item is not None:
+        ncx_path = posixpath.normpath(posixpath.join(opf_dir, ncx_item.href))
+
+    for path in members:
+        if (path not in items_by_path and path != opf_path
+                and path not in CONTAINER_MEMBERS
+                and not path.startswith(CONTAINER_DIR)
+                and not path.endswith('/')):
+            errors.append(ValidationError(UNLISTED_MEMBER, path,
+                    "'%s' is in the archive but not in the manifest." % path))
+
+    for item in publication.spine_items:
+        if not (publication.has_item(item.item_id)
+                and publication.get_item(item.item_id) is item):
+            errors.append(ValidationError(SPINE_NOT_IN_MANIFEST,
+                    item.item_id, "Spine item '%s' is not in the manifest."
+                    % item.item_id))
+
+    if toc is not None:
+        errors.extend(_validate_toc(toc, ncx_path, opf_dir, items_by_path))
+    return errors
+
+
+def _validate_toc(toc, ncx_path, opf_dir, items_by_path):
+    """Check the links and ids of every NavPoint in `toc`."""
+    errors = []
+    if ncx_path is None:
+        errors.append(ValidationError(NO_NCX_ITEM, None,
+                "There is a table of contents, but no NCX item in the "
+                "manifest."))
+        ncx_dir = opf_dir
+    else:
+        ncx_dir = posixpath.dirname(ncx_path)
+    point_ids = set()
+    # Link -> archive path, as most links are repeated with fragments:
+    resolved = {}
+    for npoint in toc.depth_first():
+        point_id = npoint.given_point_id
+        if point_id is not None:
+            if point_id in point_ids:
+                errors.append(ValidationError(DUPLICATE_POINT_ID, point_id,
+                        "navPoint id '%s' is used more than once."
+                        % point_id))
+            point_ids.add(point_id)
+        link = npoint.link.split('#', 1)[0]
+        path = resolved.get(link)
+        if path is None:
+            path = resolved[link] = posixpath.normpath(
+                    posixpath.join(ncx_dir, link))
+        if path not in items_by_path:
+            errors.append(ValidationError(BROKEN_LINK, path,
+                    "navPoint '%s' links to '%s', which is not in the "
+                    "manifest." % (npoint.label, npoint.link)))
+    return errors
+
+
+def validate_reader(reader):
+    """
+    Validate the epub opened by the EpubReader `reader`, as validate()
+    does. Documents which cannot be read or parsed are reported as errors
+    rather than raised. The OPF file is parsed leniently, so missing
+    metadata, duplicate item ids and spine idrefs missing from the manifest
+    are reported alongside every other problem.
+    """
+    try:
+        container = reader.container
+    except Exception as exc:
+        return [_unreadable(epub.format.CONTAINER_PATH, exc)]
+    if not container.rootfiles:
+        return validate(reader.namelist(), container, None)
+    errors = []
+    try:
+        stream = reader.open(reader.opf_path)
+        try:
+            root = etree.parse(stream).getroot()
+        finally:
+            stream.close()
+    except Exception as exc:
+        return [_unreadable(reader.opf_path, exc)]
+    publication = _lenient_publication(root, errors)
+    toc = None
+    ncx_item = publication.get_ncx_item()
+    if ncx_item is not None:
+        ncx_path = reader.item_path(ncx_item.href)
+        try:
+            stream = reader.open(ncx_path)
+            try:
+                toc = epub.format.TableOfContents.from_file(stream)
+            finally:
+                stream.close()
+        except Exception as exc:
+            errors.append(_unreadable(ncx_path, exc))
+    errors.extend(validate(reader.namelist(), container, publication, toc))
+    return errors
+
+
+def _lenient_publication(root, errors):
+    """
+    Build a Publication from the OPF document `root`, appending a
+    ValidationError to `errors` for each problem which would stop
+    Publication.from_root, instead of raising.
+    """
+    meta = opf.XPATH_METADATA(root)
+    values = {}
+    for name, xpath in [('title', opf.XPATH_TITLE),
+            ('identifier', opf.XPATH_IDENTIFIER),
+            ('creator', opf.XPATH_AUTHOR), ('file-as', opf.XPATH_FILEAS),
+            ('language', opf.XPATH_LANGUAGE)]:
+        found = xpath(meta[0]) if meta else []
+        if found:
+            values[name] = found[0]
+        else:
+            errors.append(ValidationError(MISSING_METADATA, name,
+                    "The OPF metadata has no %s." % name))
+    publication = epub.format.Publication(values.get('identifier'),
+            values.get('title'), values.get('creator'),
+            values.get('file-as'))
+    publication.lang = values.get('language')
+    for item in opf.XPATH_ITEMS(root):
+        attrib = item.attrib
+        if not attrib.get('id') or not attrib.get('href'):
+            errors.append(ValidationError(INVALID_ITEM,
+                    attrib.get('id') or attrib.get('href'),
+                    "A manifest item has no id or no href."))
+            continue
+        if publication.has_item(attrib.get('id')):
+            errors.append(ValidationError(DUPLICATE_ID, attrib.get('id'),
+                    "Item id '%s' is used more than once."
+                    % attrib.get('id')))
+            continue
+        try:
+            publication.add_item(attrib.get('href'), attrib.get('id'), False,
+                    attrib.get('media-type'))
+        except RuntimeError:
+            errors.append(ValidationError(UNKNOWN_MEDIA_TYPE,
+                    attrib.get('id'), "Item '%s' has no media-type, and none "
+                    "is known for '%s'." % (attrib.get('id'),
+                    attrib.get('href'))))
+    for idref in opf.XPATH_SPINE_IDREFS(root):
+        if publication.has_item(idref):
+            publication.append_to_spine(idref)
+        else:
+            errors.append(ValidationError(SPINE_NOT_IN_MANIFEST, idref,
+                    "Spine item '%s' is not in the manifest." % idref))
+    return publication
+
+
+def _unreadable(path, exc):
+    return ValidationError(UNREADABLE, path,
+            "Could not read '%s': %s" % (path, exc))
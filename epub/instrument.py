@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+"""
+Instrumentation for the parse, render and archive-writing stages of an epub
+build.
+
+Instrumented code reports an Event for each stage it completes to every
+registered listener. When no listeners are registered, the only cost to
+instrumented code is a check of an empty list.
+
+    with epub.instrument.collect() as stats:
+        build_my_book()
+    stats.dump(sys.stderr)
+
+Stages currently reported are:
+
+    container.parse, container.render
+    opf.parse_xml, opf.from_root, opf.render, opf.write
+    ncx.parse_xml, ncx.from_tree, ncx.render, ncx.write
+    archive.compress, archive.write
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+__all__ = ['Event', 'Aggregator', 'add_listener', 'remove_listener',
+        'collect', 'start', 'emit', 'encoded_size', 'counting',
+        'file_size']
+
+# Callables which are passed each Event. Instrumented code checks this list
+# before doing any work on behalf of listeners:
+listeners = []
+
+
+class Event(object):
+    """
+    Describes a single completed stage: its name, the archive member or
+    document it applied to (if any), how long it took in seconds, and the
+    size in bytes of its input and output (where known, otherwise None).
+    """
+    __slots__ = ['stage', 'name', 'seconds', 'input_size', 'output_size']
+
+    def __init__(self, stage, seconds, name=None, input_size=None,
+            output_size=None):
+        self.stage = stage
+        self.seconds = seconds
+        self.name = name
+        self.input_size = input_size
+        self.output_size = output_size
+
+    def __repr__(self):
+        return '<Event %s %r %.6fs in=%r out=%r>' % (self.stage, self.name,
+                self.seconds, self.input_size, self.output_size)
+
+
+def add_listener(listener):
+    """Register `listener` to be called with every Event."""
+    listeners.append(listener)
+
+
+def remove_listener(listener):
+    """Stop calling `listener` with Events."""
+    listeners.remove(listener)
+
+
+def start():
+    """
+    Return a start time to be passed to emit() when the stage ends, or None
+    if nothing is listening, in which case the stage need not be reported.
+    """
+    if listeners:
+        return time.time()
+    return None
+
+
+def emit(stage, started, name=None, input_size=None, output_size=None):
+    """
+    Report that `stage`, which began at `started` (as returned by start()),
+    has completed. Does nothing if `started` is None.
+    """
+    if started is None:
+        return
+    event = Event(stage, time.time() - started, name, input_size,
+            output_size)
+    for listener in list(listeners):
+        listener(event)
+
+
+def encoded_size(started, text, encoding='utf-8'):
+    """
+    Return the size in bytes of the unicode `text` once encoded, or None if
+    `started` is None, so that it is only measured for listeners.
+    """
+    if started is None:
+        return None
+    return len(text.encode(encoding))
+
+
+class CountingFile(object):
+    """
+    Wraps a file-like object, passing reads and writes through to it and
+    counting the bytes read or written in `size`.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.size += len(data)
+        return data
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.size += len(data)
+
+
+def counting(started, path_or_file):
+    """
+    Return `path_or_file` for a stage which began at `started`, wrapped in a
+    CountingFile if it is a file-like object and the stage is being
+    reported, so that file_size can measure it.
+    """
+    if started is None or not (hasattr(path_or_file, 'read')
+            or hasattr(path_or_file, 'write')):
+        return path_or_file
+    return CountingFile(path_or_file)
+
+
+def file_size(started, path_or_file):
+    """
+    Return the bytes read from or written to `path_or_file` (as returned by
+    counting) during a stage which began at `started`, or None if the stage
+    is not being reported or the size is unknown.
+    """
+    if started is None:
+        return None
+    if isinstance(path_or_file, CountingFile):
+        return path_or_file.size
+    try:
+        return os.path.getsize(path_or_file)
+    except (TypeError, OSError):
+        return None
+
+
+class Aggregator(object):
+    """
+    A listener which totals the count, time and byte sizes of each stage.
+    If `keep_events` is true, every Event is also kept in `events`.
+    Aggregator may be called from several threads at once.
+    """
+
+    def __init__(self, keep_events=False):
+        self.stages = {}
+        self.events = [] if keep_events else None
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            totals = self.stages.get(event.stage)
+            if totals is None:
+                totals = self.stages[event.stage] = {'count': 0,
+                        'seconds': 0.0, 'input_bytes': 0, 'output_bytes': 0}
+            totals['count'] += 1
+            totals['seconds'] += event.seconds
+            totals['input_bytes'] += event.input_size or 0
+            totals['output_bytes'] += event.output_size or 0
+            if self.events is not None:
+                self.events.append(event)
+
+    def stats(self):
+        """Return a copy of the per-stage totals, keyed by stage."""
+        with self._lock:
+            return dict((stage, dict(totals))
+                    for stage, totals in self.stages.items())
+
+    def dump(self, stream):
+        """Write the per-stage totals to `stream` as JSON."""
+        json.dump(self.stats(), stream, indent=2, sort_keys=True)
+        stream.write('\n')
+
+
+@contextlib.contextmanager
+def collect(keep_events=False):
+    """
+    A context-manager which registers a new Aggregator for the duration of
+    the `with` block, and provides it as the `as` target.
+    """
+    aggregator = Aggregator(keep_events)
+    add_listener(aggregator)
+    try:
+        yield aggregator
+    finally:
+        remove_listener(aggregator)
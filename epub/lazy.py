@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""
+Deferred imports and compilation, so that importing epub.format does not pay
+for lxml, jinja2 or template compilation until a code path needs them.
+
+    etree = lazy.module('lxml.etree')
+    XPATH_TITLE = lazy.XPath('dc:title/text()', namespaces=NSMAP)
+    tmpl = lazy.Template(TEMPLATE_SOURCE)
+
+Each object does its work on first use, and is thereafter as cheap to use as
+the thing it stands in for.
+"""
+
+import importlib
+import threading
+
+__all__ = ['module', 'XPath', 'Template']
+
+# Serialises first-use work, for objects shared between threads:
+_lock = threading.RLock()
+
+
+class module(object):
+    """
+    Stands in for the module `name`, importing it when any attribute is
+    first looked up. Once imported, the module's attributes are copied onto
+    this object, so later lookups cost the same as they would on the module.
+    """
+
+    def __init__(self, name):
+        self.__name = name
+
+    def __getattr__(self, attr):
+        with _lock:
+            real = importlib.import_module(self.__name)
+            self.__dict__.update(real.__dict__)
+        return getattr(real, attr)
+
+    def __repr__(self):
+        return '<lazy module %r>' % self.__name
+
+
+class XPath(object):
+    """An lxml.etree.XPath which is compiled when it is first called."""
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self.kwargs = kwargs
+        self.compiled = None
+
+    def __call__(self, *args, **kwargs):
+        compiled = self.compiled
+        if compiled is None:
+            from lxml import etree
+            compiled = self.compiled = etree.XPath(self.path, **self.kwargs)
+        return compiled(*args, **kwargs)
+
+
+class Template(object):
+    """
+    A jinja2 template which is compiled the first time it is rendered. The
+    compiled jinja2.Template is shared by all threads.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.compiled = None
+
+    def render(self, *args, **kwargs):
+        compiled = self.compiled
+        if compiled is None:
+            with _lock:
+                if self.compiled is None:
+                    import jinja2
+                    self.compiled = jinja2.Template(self.source)
+                compiled = self.compiled
+        return compiled.render(*args, **kwargs)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""
+Splits oversized XHTML content documents into several smaller ones, which
+e-readers open much faster.
+
+    parts = split_documents([('c1.html', data, 'c1'), ...], pub, toc,
+            max_size=256 * 1024)
+    for href, data in parts:
+        book.writestr(posixpath.join(opf_dir, href), data)
+
+Documents are split between the block-level children of their body. A child
+which is itself too large, such as a <div> or <section> wrapping the whole
+chapter, is split between its own children, with its start tag repeated in
+each part. The first part of a document keeps the original href, so links
+to the document as a whole need not change; later parts are named
+'c1-2.html', 'c1-3.html', and so on.
+
+Links between the documents (the href attribute of any element) and the
+NavPoint links of the table of contents are rewritten so that links to an id
+point at the part containing it. Hrefs, including NavPoint links, are taken
+to be relative to the location of the OPF file, as manifest hrefs are.
+"""
+
+import posixpath
+
+from lxml import etree
+
+from epub.process.lxmlext import xhtml
+
+__all__ = ['split_documents', 'split_document']
+
+DEFAULT_MAX_SIZE = 256 * 1024
+
+# Elements which may be split between their children when they are too big:
+CONTAINERS = frozenset(xhtml + tag for tag in ['div', 'section', 'article',
+        'aside', 'blockquote', 'main', 'header', 'footer', 'nav', 'figure'])
+
+
+def _size(element):
+    """The serialised size of `element`, in bytes."""
+    return len(etree.tostring(element, encoding='utf-8'))
+
+
+def _partition(children, limit):
+    """
+    Divide the elements `children` into lists whose serialised size is
+    within `limit` where possible, moving the contents of oversized
+    containers into copies of the container. Returns a list of lists.
+    """
+    parts = [[]]
+    size = 0
+    for child in children:
+        pieces = [(child, _size(child))]
+        if (pieces[0][1] > limit and child.tag in CONTAINERS
+                and len(child)):
+            pieces = list(_split_container(child, limit))
+        for piece, piece_size in pieces:
+            if parts[-1] and size + piece_size > limit:
+                parts.append([])
+                size = 0
+            parts[-1].append(piece)
+            size += piece_size
+    return parts
+
+
+def _split_container(container, limit):
+    """
+    Split the oversized `container` between its children, yielding a
+    (container copy, size) pair for each group. Only the first copy keeps
+    the container's id and text, and only the last its tail.
+    """
+    attrib = dict(container.attrib)
+    attrib.pop('id', None)
+    groups = _partition(list(container), limit)
+    for index, group in enumerate(groups):
+        if index == 0:
+            copy = etree.Element(container.tag, dict(container.attrib),
+                    nsmap=container.nsmap)
+            copy.text = container.text
+        else:
+            copy = etree.Element(container.tag, attrib,
+                    nsmap=container.nsmap)
+        copy.extend(group)
+        if index == len(groups) - 1:
+            copy.tail = container.tail
+        yield copy, _size(copy)
+
+
+def split_document(tree, max_size=DEFAULT_MAX_SIZE):
+    """
+    Split the XHTML lxml.etree.ElementTree `tree`, if it serialises to more
+    than `max_size` bytes, returning a list of ElementTrees, one per part.
+    `tree` itself is returned as the only part if it is small enough or has
+    no body. Parts may still exceed `max_size` if they are a single element
+    which cannot be split. Only the first part keeps any text directly in
+    the body before its first element.
+    """
+    root = tree.getroot()
+    body = root.find(xhtml + 'body')
+    if body is None or _size(root) <= max_size:
+        return [tree]
+    # Allow for everything but the content of the body in each part:
+    children = list(body)
+    for child in children:
+        body.remove(child)
+    limit = max(max_size - _size(root), 1)
+    groups = _partition(children, limit)
+    if len(groups) == 1:
+        body.extend(groups[0])
+        return [tree]
+    text, body.text = body.text, None
+    skeleton = etree.tostring(root)
+    body.text = text
+    parts = []
+    for index, group in enumerate(groups):
+        part = etree.ElementTree(root if index == 0 else
+                etree.fromstring(skeleton))
+        part.getroot().find(xhtml + 'body').extend(group)
+        parts.append(part)
+    return parts
+
+
+def _part_href(href, index):
+    """Return the href of part `index` (from 0) of the document `href`."""
+    if index == 0:
+        return href
+    base, ext = posixpath.splitext(href)
+    return '%s-%d%s' % (base, index + 1, ext)
+
+
+class _LinkMap(object):
+    """Maps the targets of links within the book onto the split parts."""
+
+    def __init__(self):
+        # (original href, id) -> part href:
+        self.ids = {}
+        # Hrefs of documents which were split:
+        self.split = set()
+
+    def resolve(self, link, base_href, source_href=None):
+        """
+        Return `link`, which appears in the document or part `base_href`,
+        rewritten to point at the right part, or None if it need not change.
+        `source_href` is the href of the document the part was split from.
+        """
+        path, _, fragment = link.partition('#')
+        if not fragment or ':' in path.split('/', 1)[0] or path[:1] == '/':
+            return None
+        base_dir = posixpath.dirname(base_href)
+        target = (posixpath.normpath(posixpath.join(base_dir, path))
+                if path else source_href)
+        if target not in self.split:
+            return None
+        part = self.ids.get((target, fragment))
+        if part is None:
+            return None
+        if part == base_href:
+            return '#' + fragment
+        return '%s#%s' % (posixpath.relpath(part, base_dir or '.'), fragment)
+
+
+def split_documents(documents, publication, toc=None,
+        max_size=DEFAULT_MAX_SIZE):
+    """
+    Split each of the XHTML `documents` which is larger than `max_size`
+    bytes, and add every document or part to the manifest and spine of
+    `publication` with Publication.add_item, in order.
+    
+    `documents` is a list of (href, data, item_id) tuples, in manifest
+    order, where data is the document's bytes and item_id may be None. A
+    tuple may have a fourth element: a dict of further keyword arguments for
+    add_item, such as spine_item. Items with None as their data are not
+    documents to split, but are added to the publication in their place so
+    that the manifest and spine keep the order given. Parts after the first
+    are given the item_id with '-2', '-3' etc. appended, or a generated id.
+    Links between the documents, and in `toc` (if provided), are rewritten
+    to point at the right parts.
+    
+    Returns a list of (href, data) tuples, in order, for the items, documents
+    and parts to be written to the archive; data is None for the items
+    which were passed through. Documents which were neither split nor had
+    links rewritten are returned unchanged.
+    """
+    links = _LinkMap()
+    # (part href, document href, doctype, tree, data or None if it must be
+    # serialised) for each document or part:
+    parsed = []
+    for document in documents:
+        href, data, item_id = document[:3]
+        options = document[3] if len(document) > 3 else {}
+        if data is None:
+            publication.add_item(href, item_id, **options)
+            parsed.append((href, href, None, None, None))
+            continue
+        tree = etree.ElementTree(etree.fromstring(data))
+        doctype = tree.docinfo.doctype or None
+        if len(data) > max_size:
+            parts = split_document(tree, max_size)
+        else:
+            parts = [tree]
+        if len(parts) > 1:
+            links.split.add(href)
+        for index, part in enumerate(parts):
+            part_href = _part_href(href, index)
+            part_id = item_id
+            if index and item_id is not None:
+                part_id = '%s-%d' % (item_id, index + 1)
+            publication.add_item(part_href, part_id, **options)
+            if len(parts) > 1:
+                for element in part.iter(etree.Element):
+                    element_id = element.get('id')
+                    if element_id is not None:
+                        links.ids[(href, element_id)] = part_href
+            parsed.append((part_href, href, doctype, part,
+                    None if len(parts) > 1 else data))
+
+    if not links.split:
+        return [(href, data) for href, _, _, _, data in parsed]
+
+    result = []
+    for href, source_href, doctype, tree, data in parsed:
+        if tree is None:
+            result.append((href, None))
+            continue
+        changed = data is None
+        for element in tree.iter(etree.Element):
+            link = element.get('href')
+            if link is not None:
+                new_link = links.resolve(link, href, source_href)
+                if new_link is not None:
+                    element.set('href', new_link)
+                    changed = True
+        if changed:
+            data = etree.tostring(tree, encoding='utf-8',
+                    xml_declaration=True, doctype=doctype)
+        result.append((href, data))
+
+    if toc is not None:
+        for npoint in toc.depth_first():
+            new_link = links.resolve(npoint.link, '')
+            if new_link is not None:
+                npoint.link = new_link
+    return result
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+"""
+A rule-based engine for cleaning up XHTML documents in a single pass.
+
+Rules are registered once on a Transformer, keyed by tag (in Clark notation,
+such as lxmlext.xhtml + 'span'), and are all applied during a single walk of
+each document:
+
+    transformer = Transformer()
+    transformer.unwrap(xhtml + 'span')
+    transformer.drop_empty(xhtml + 'p')
+    transformer.rename(xhtml + 'b', xhtml + 'strong')
+    transformer.strip_attributes(xhtml + 'p', 'style')
+    transform_directory(transformer, 'chapters')
+
+Unwrapping gives the same result as calling
+lxmlext.replace_tag_with_contents on each unwrapped element, innermost
+first, but all the children of an element which are unwrapped or dropped are
+dealt with together, so each text node is only built once. Calling the
+helper on outer elements first can add spaces where an emptied inner
+element used to be: `<span><span/></span>x` becomes ' x' rather than 'x'.
+The Transformer deliberately never does this.
+"""
+
+import glob
+import multiprocessing
+import os
+
+from lxml import etree
+
+from epub.process.lxmlext import is_empty
+
+__all__ = ['Transformer', 'transform_files', 'transform_directory']
+
+UNWRAP = 'unwrap'
+DROP = 'drop'
+
+
+class Transformer(object):
+    """
+    A set of rules, applied to documents with apply() or apply_file().
+    
+    Each element is visited once, after all of its descendants. Renames and
+    attribute-stripping are applied first, then the element is removed if
+    it is empty and matches a drop_empty rule, or otherwise replaced with its
+    contents if it matches an unwrap rule. Rules are looked up by the
+    element's tag before it is renamed.
+    
+    Transformers can be pickled, so they can be sent to worker processes.
+    Calling a Transformer is the same as calling apply(), so it can be used
+    as an epub.build.pipeline step.
+    """
+
+    def __init__(self):
+        # tag -> new tag:
+        self.renames = {}
+        # tag -> attribute names to remove, or None for all attributes:
+        self.stripped = {}
+        self.unwrapped = set()
+        self.dropped = set()
+
+    def unwrap(self, *tags):
+        """Replace elements with any of `tags` with their contents."""
+        self.unwrapped.update(tags)
+
+    def drop_empty(self, *tags):
+        """
+        Remove elements with any of `tags` which have no children and no
+        text other than whitespace (see lxmlext.is_empty).
+        """
+        self.dropped.update(tags)
+
+    def rename(self, tag, new_tag):
+        """Change the tag of elements with `tag` to `new_tag`."""
+        self.renames[tag] = new_tag
+
+    def strip_attributes(self, tag, *attributes):
+        """
+        Remove `attributes` from elements with `tag`, or all of their
+        attributes if none are given.
+        """
+        self.stripped[tag] = set(attributes) or None
+
+    def apply(self, tree):
+        """
+        Apply every rule to the lxml.etree document or element `tree`, in
+        place, and return its root element.
+        """
+        root = tree.getroot() if hasattr(tree, 'getroot') else tree
+        renames, stripped = self.renames, self.stripped
+        unwrapped, dropped = self.unwrapped, self.dropped
+        # parent -> {child: UNWRAP or DROP}, for children awaiting removal:
+        pending = {}
+        elements = list(root.iter(etree.Element))
+        elements.reverse()
+        for element in elements:
+            marks = pending.pop(element, None)
+            if marks:
+                _remove_children(element, marks)
+            tag = element.tag
+            if tag in renames:
+                element.tag = renames[tag]
+            if tag in stripped:
+                names = stripped[tag]
+                attrib = element.attrib
+                if names is None:
+                    attrib.clear()
+                else:
+                    for name in names.intersection(attrib.keys()):
+                        del attrib[name]
+            parent = element.getparent()
+            if parent is None:
+                continue
+            if tag in dropped and is_empty(element):
+                pending.setdefault(parent, {})[element] = DROP
+            elif tag in unwrapped:
+                pending.setdefault(parent, {})[element] = UNWRAP
+        return root
+
+    __call__ = apply
+
+    def apply_file(self, path, output=None):
+        """
+        Apply every rule to the XML file at `path`, writing the result to
+        `output` (by default, back to `path`).
+        """
+        tree = etree.parse(path)
+        self.apply(tree)
+        tree.write(output or path, encoding='utf-8', xml_declaration=True)
+
+
+class _Text(object):
+    """
+    Builds the text which will follow an element (its tail), or begin its
+    parent (the parent's text), from pieces, joining them only once.
+    """
+
+    def __init__(self, owner, is_tail, value):
+        self.owner = owner
+        self.is_tail = is_tail
+        self.pieces = [] if value is None else [value]
+        self.length = len(value or '')
+
+    def add(self, text, spaced, space_if_empty=False):
+        """
+        Append `text`. If `spaced`, a space is put before it, as
+        replace_tag_with_contents would: always when adding to a tail, and
+        when adding to a parent's text that is non-empty (or, if
+        `space_if_empty`, not None).
+        """
+        if spaced and (self.is_tail or self.length
+                or (space_if_empty and self.pieces)):
+            self.pieces.append(' ')
+            self.length += 1
+        self.pieces.append(text)
+        self.length += len(text)
+
+    def store(self):
+        """Set the built text on its owner."""
+        value = ''.join(self.pieces) if self.pieces else None
+        if self.is_tail:
+            if self.owner.tail != value:
+                self.owner.tail = value
+        elif self.owner.text != value:
+            self.owner.text = value
+
+
+def _remove_children(parent, marks):
+    """
+    Unwrap or drop the children of `parent` marked in the dict `marks`,
+    joining the text around them.
+    """
+    text = _Text(parent, False, parent.text)
+    for child in list(parent):
+        action = marks.get(child)
+        if action is None:
+            text.store()
+            text = _Text(child, True, child.tail)
+            continue
+        if action == UNWRAP:
+            if child.text:
+                text.add(child.text, True)
+            for grandchild in list(child):
+                child.addprevious(grandchild)
+                text.store()
+                text = _Text(grandchild, True, grandchild.tail)
+            if child.tail:
+                text.add(child.tail, True, space_if_empty=True)
+        elif child.tail:
+            text.add(child.tail, False)
+        parent.remove(child)
+    text.store()
+
+
+def _transform_file(args):
+    """Pool worker: apply a Transformer to a single file."""
+    transformer, path = args
+    transformer.apply_file(path)
+    return path
+
+
+def transform_files(transformer, paths, processes=None):
+    """
+    Apply `transformer` to each XML file in `paths`, in place, on a pool of
+    `processes` worker processes (by default, one per CPU). Returns the
+    list of paths.
+    """
+    pool = multiprocessing.Pool(processes)
+    try:
+        result = pool.map(_transform_file,
+                [(transformer, path) for path in paths])
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return result
+
+
+def transform_directory(transformer, directory, pattern='*.xhtml',
+        processes=None):
+    """
+    Apply `transformer`, in place, to every file in `directory` matching
+    `pattern`, using transform_files.
+    """
+    return transform_files(transformer,
+            sorted(glob.glob(os.path.join(directory, pattern))), processes)
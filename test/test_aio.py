@@ -0,0 +1,49 @@
+import io
+import unittest
+import zipfile
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+
+class _Writer(object):
+    """A minimal stand-in for asyncio.StreamWriter."""
+    def __init__(self, loop):
+        self.loop = loop
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def drain(self):
+        drained = self.loop.create_future()
+        drained.set_result(None)
+        return drained
+
+
+@unittest.skipIf(asyncio is None, "asyncio is not available")
+class AsyncEpubTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_stream(self):
+        """Members are written in order and streamed as they complete"""
+        from epub.format.aio import AsyncEpub
+        writer = _Writer(self.loop)
+        book = AsyncEpub(writer, self.loop, workers=2)
+        self.loop.run_until_complete(book.__aenter__())
+        self.assertEqual(1, len(writer.chunks))
+        futures = [book.writestr('c%d.html' % index, '<p>%d</p>' % index)
+                for index in range(10)]
+        self.loop.run_until_complete(asyncio.gather(*futures))
+        self.loop.run_until_complete(book.__aexit__(None, None, None))
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(writer.chunks)))
+        self.assertEqual(None, archive.testzip())
+        self.assertEqual(['mimetype'] + ['c%d.html' % i for i in range(10)],
+                archive.namelist())
+        self.assertEqual(b'<p>9</p>', archive.read('c9.html'))
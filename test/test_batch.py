@@ -0,0 +1,132 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+CHAPTER = """<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml">
+  <head><title>Chapter 1</title></head>
+  <body><p>It was a dark and stormy night.</p></body>
+</html>"""
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory, 'c1.html'), 'w') as out:
+            out.write(CHAPTER)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write_spec(self, name, **overrides):
+        spec = {
+            'output': name + '.epub',
+            'unique_id': name,
+            'title': 'The Sedan Chair',
+            'author': 'Mark Smith',
+            'fileas': 'Smith, Mark',
+            'files': [{'path': 'c1.html', 'href': 'c1.html', 'id': 'c1'}],
+            'toc': [{'label': 'Chapter 1', 'link': 'c1.html', 'children': [
+                {'label': 'Section 1', 'link': 'c1.html#s1'}]}],
+        }
+        spec.update(overrides)
+        path = os.path.join(self.directory, name + '.json')
+        with open(path, 'w') as out:
+            json.dump(spec, out)
+        return path
+
+    def test_build_all(self):
+        """Books build in parallel, and failures are isolated"""
+        from epub.build import batch
+        from epub.format import Epub
+        good = [self._write_spec('book%d' % index) for index in range(3)]
+        bad = self._write_spec('bad', files=[
+                {'path': 'missing.html', 'href': 'missing.html'}])
+        seen = []
+        results = batch.build_all(good + [bad], 2, seen.append)
+        self.assertEqual(4, len(seen))
+        summary = batch.summarise(results)
+        self.assertEqual((3, 1), (summary['succeeded'], summary['failed']))
+        failure = [r for r in results if not r['ok']][0]
+        self.assertEqual(bad, failure['spec'])
+        self.assertTrue('missing.html' in failure['error'])
+        with Epub.open(os.path.join(self.directory, 'book1.epub')) as book:
+            self.assertEqual(['ncx', 'c1'], book.publication.item_ids)
+            self.assertEqual(2, len(list(book.toc.depth_first())))
+            self.assertEqual(CHAPTER, book.read('OEBPS/c1.html'))
+
+    def test_main(self):
+        """The command-line entry point writes a report"""
+        from epub.build import batch
+        report = os.path.join(self.directory, 'report.json')
+        status = batch.main(['-j', '1', '--report', report,
+                self._write_spec('book')])
+        self.assertEqual(0, status)
+        with open(report) as summary:
+            self.assertEqual(1, json.load(summary)['succeeded'])
+
+    def test_reproducible(self):
+        """Reproducible builds of unchanged input are identical"""
+        from epub.build import batch
+        spec = self._write_spec('book', reproducible=True, files=[
+                {'path': 'c1.html', 'href': 'c1.html'}])
+        outputs = []
+        for mtime in (1000000000, 1200000000):
+            os.utime(os.path.join(self.directory, 'c1.html'), (mtime, mtime))
+            result = batch.build_book(spec)
+            self.assertTrue(result['ok'], result['error'])
+            with open(result['output'], 'rb') as output:
+                outputs.append(output.read())
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_split(self):
+        """Oversized chapters are split into several spine items"""
+        from epub.build import batch
+        from epub.format import Epub
+        with open(os.path.join(self.directory, 'c1.html'), 'w') as out:
+            out.write(CHAPTER.replace('<body>',
+                    '<body>' + '<p>Filler.</p>' * 100).replace(
+                    '<p>It was', '<p id="s1">It was'))
+        for name in ['cover.html', 'c2.html', 'style.css']:
+            with open(os.path.join(self.directory, name), 'w') as out:
+                out.write(CHAPTER if name.endswith('.html') else 'p {}')
+        spec = self._write_spec('book', split_size=1024, files=[
+                {'path': 'cover.html', 'href': 'cover.html', 'spine': True},
+                {'path': 'c1.html', 'href': 'c1.html', 'id': 'c1'},
+                {'path': 'style.css', 'href': 'style.css'},
+                {'path': 'c2.html', 'href': 'c2.html'}])
+        result = batch.build_book(spec)
+        self.assertTrue(result['ok'], result['error'])
+        with Epub.open(result['output']) as book:
+            hrefs = [item.href for item in book.publication.spine_items]
+            self.assertEqual(['cover.html', 'c1.html', 'c1-2.html'],
+                    hrefs[:3])
+            self.assertEqual('c2.html', hrefs[-1])
+            self.assertEqual('style.css', book.publication.items[-2].href)
+            link = [npoint.link for npoint in book.toc.depth_first()][1]
+            self.assertEqual(hrefs[-2] + '#s1', link)
+            self.assertEqual([], book.validate())
+            self.assertEqual(b'p {}', book.read('OEBPS/style.css'))
+
+    def test_failed_build_keeps_output(self):
+        """A failed build leaves the previous book in place"""
+        from epub.build import batch
+        result = batch.build_book(self._write_spec('book'))
+        self.assertTrue(result['ok'], result['error'])
+        with open(result['output'], 'rb') as output:
+            original = output.read()
+        for overrides in [
+                {'files': [{'path': 'missing.html', 'href': 'missing.html'}]},
+                {'toc': [{'label': 'Chapter 9', 'link': 'c9.html'}]}]:
+            failed = batch.build_book(self._write_spec('book', **overrides))
+            self.assertFalse(failed['ok'])
+            if 'toc' in overrides:
+                self.assertEqual(['toc.broken_link'],
+                        [error['code'] for error in failed['errors']])
+                self.assertTrue('c9.html' in failed['error'])
+            with open(result['output'], 'rb') as output:
+                self.assertEqual(original, output.read())
+        self.assertEqual(['book.epub', 'book.json', 'c1.html'],
+                sorted(os.listdir(self.directory)))
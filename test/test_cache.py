@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+import zlib
+
+
+class BlobCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _get_cache(self, **kwargs):
+        from epub.format.cache import BlobCache
+        return BlobCache(os.path.join(self.directory, 'cache'), **kwargs)
+
+    def test_hit(self):
+        """Cached results match archive.compress"""
+        from epub.format import archive
+        cache = self._get_cache()
+        data = b'Some repetitive content. ' * 100
+        expected = archive.compress(data, zipfile.ZIP_DEFLATED, 6)
+        self.assertEqual(expected,
+                cache.compress(data, zipfile.ZIP_DEFLATED, 6))
+        self.assertEqual(expected,
+                cache.compress(data, zipfile.ZIP_DEFLATED, 6))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        # Different settings are cached separately:
+        cache.compress(data, zipfile.ZIP_DEFLATED, 9)
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+        # The cache persists between instances:
+        cache = self._get_cache()
+        self.assertEqual(expected,
+                cache.compress(data, zipfile.ZIP_DEFLATED, 6))
+        self.assertEqual((1, 0), (cache.hits, cache.misses))
+
+    def test_eviction(self):
+        """The least-recently-used entries are evicted"""
+        cache = self._get_cache(max_size=3000)
+        blobs = [os.urandom(1000) for _ in range(4)]
+        paths = [cache._path(cache.key(blob, zipfile.ZIP_DEFLATED, 6))
+                for blob in blobs]
+        for blob in blobs[:2]:
+            cache.compress(blob, zipfile.ZIP_DEFLATED, 6)
+        # Reading the first entry makes the second the least recently used:
+        cache.compress(blobs[0], zipfile.ZIP_DEFLATED, 6)
+        cache.compress(blobs[2], zipfile.ZIP_DEFLATED, 6)
+        self.assertTrue(cache.size <= 3000)
+        self.assertEqual([True, False, True],
+                [os.path.exists(path) for path in paths[:3]])
+        self.assertEqual((1, 3), (cache.hits, cache.misses))
+        # A new cache orders existing entries by their last use:
+        os.utime(paths[0], (1000000000, 1000000000))
+        cache = self._get_cache(max_size=3000)
+        cache.compress(blobs[3], zipfile.ZIP_DEFLATED, 6)
+        self.assertEqual([False, False, True, True],
+                [os.path.exists(path) for path in paths])
+
+    def test_stored(self):
+        """Stored members bypass the cache"""
+        from epub.format import archive
+        cache = self._get_cache()
+        data = b'Some repetitive content. ' * 100
+        self.assertEqual(archive.compress(data, zipfile.ZIP_STORED),
+                cache.compress(data, zipfile.ZIP_STORED,
+                    zlib.Z_DEFAULT_COMPRESSION))
+        self.assertEqual((0, 0, 0), (cache.hits, cache.misses, cache.size))
+
+    def test_epub(self):
+        """Epub builds with a cache produce the same archive"""
+        from epub.format import Epub
+        cache = self._get_cache()
+        path = os.path.join(self.directory, 'book.epub')
+        outputs = []
+        for _ in range(2):
+            with Epub(path, cache=cache) as book:
+                for index in range(10):
+                    book.write(__file__, 'file%d.py' % index)
+            with open(path, 'rb') as result:
+                outputs.append(result.read())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual((19, 1), (cache.hits, cache.misses))
@@ -53,4 +53,9 @@ class ContainerTestCase(unittest.TestCase):
     def test_output(self):
         c = ec.Container()
         c.add_rootfile('/contents.opf')
-        print c.as_epub_container()
\ No newline at end of file
+        print c.as_epub_container()
+    def test_iterparse(self):
+        """Incremental container.xml parsing"""
+        c = ec.Container.iterparse(StringIO(SAMPLE))
+        self.assertEqual([('/a/path', "application/oebps-package+xml")],
+                c.rootfiles)
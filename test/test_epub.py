@@ -0,0 +1,324 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+import zlib
+
+CHAPTER = """<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml">
+  <head><title>Chapter 1</title></head>
+  <body><p>It was a dark and stormy night.</p></body>
+</html>"""
+
+
+def build_sample(path, **kwargs):
+    """Write a small but complete epub to `path`."""
+    from epub.format import Epub, Container, Publication, TableOfContents
+    from epub.format.toc import NavPoint
+    container = Container()
+    container.add_rootfile('OEBPS/content.opf')
+    pub = Publication('unique-id', 'The Sedan Chair', 'Mark Smith',
+            'Smith, Mark')
+    pub.add_item('toc.ncx', 'ncx')
+    pub.add_item('c1.html', 'c1')
+    toc = TableOfContents('unique-id', 'The Sedan Chair', 'Mark Smith')
+    toc.nav_points.append(NavPoint('Chapter 1', 'c1.html', 'np1'))
+    with Epub(path, **kwargs) as book:
+        book.writestr('META-INF/container.xml',
+                container.as_epub_container())
+        book.writestr('OEBPS/content.opf', pub.as_opf())
+        book.writestr('OEBPS/toc.ncx', toc.to_ncx())
+        book.writestr('OEBPS/c1.html', CHAPTER)
+
+
+class EpubTestCase(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.epub')
+        os.close(handle)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_write(self):
+        """mimetype is the first, uncompressed member"""
+        build_sample(self.path)
+        archive = zipfile.ZipFile(self.path)
+        first = archive.infolist()[0]
+        self.assertEqual('mimetype', first.filename)
+        self.assertEqual(zipfile.ZIP_STORED, first.compress_type)
+        self.assertEqual(None, archive.testzip())
+        self.assertEqual(CHAPTER, archive.read('OEBPS/c1.html'))
+
+    def test_read(self):
+        """EpubReader parses documents lazily"""
+        from epub.format import Epub
+        build_sample(self.path)
+        with Epub.open(self.path) as reader:
+            self.assertEqual(None, reader._publication)
+            self.assertEqual('OEBPS/content.opf', reader.opf_path)
+            self.assertEqual(['ncx', 'c1'], reader.publication.item_ids)
+            self.assertEqual(None, reader._toc)
+            self.assertEqual('np1', reader.toc.nav_points[0].point_id)
+            path = reader.item_path(reader.publication.get_item('c1').href)
+            self.assertEqual('OEBPS/c1.html', path)
+            self.assertEqual(CHAPTER, reader.open(path).read())
+        with Epub.open(self.path, iterparse=True) as reader:
+            self.assertEqual(['ncx', 'c1'], reader.publication.item_ids)
+            self.assertEqual('np1', reader.toc.nav_points[0].point_id)
+
+    def test_workers(self):
+        """Output is identical regardless of the number of workers"""
+        from epub.format import Epub
+        directory = tempfile.mkdtemp()
+        try:
+            sources = []
+            for index in range(20):
+                source = os.path.join(directory, 'c%d.html' % index)
+                with open(source, 'wb') as out:
+                    out.write(CHAPTER * (index + 1))
+                os.utime(source, (1000000000, 1000000000))
+                sources.append(source)
+            outputs = []
+            for workers in (None, 4):
+                with Epub(self.path, workers=workers) as book:
+                    for source in sources:
+                        book.write(source, 'OEBPS/' + os.path.basename(source))
+                with open(self.path, 'rb') as result:
+                    outputs.append(result.read())
+            self.assertEqual(outputs[0], outputs[1])
+            archive = zipfile.ZipFile(self.path)
+            self.assertEqual('mimetype', archive.namelist()[0])
+            self.assertEqual(None, archive.testzip())
+            self.assertEqual(CHAPTER * 20, archive.read('OEBPS/c19.html'))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_policy(self):
+        """Members are compressed according to the CompressionPolicy"""
+        from epub.format import Epub, archive
+        policy = archive.CompressionPolicy(levels={
+                'text/css': 1, 'html': None})
+        self.assertEqual(1, policy.level('style/main.css'))
+        self.assertEqual(None, policy.level('c1.HTML'))
+        for name in ['cover.jpg', 'track.mp3', 'track.m4a', 'clip.mp4',
+                'extra.zip', 'font.woff', 'font.woff2']:
+            self.assertEqual(None, archive.DEFAULT_POLICY.level(name))
+        self.assertEqual(zlib.Z_DEFAULT_COMPRESSION,
+                archive.DEFAULT_POLICY.level('c1.html'))
+        self.assertEqual(9, archive.SMALLEST_POLICY.level('cover.jpg'))
+        self.assertEqual(1, archive.FAST_POLICY.level('c1.html'))
+        with Epub(self.path, policy=policy) as book:
+            book.writestr('c1.html', CHAPTER)
+            book.writestr('main.css', 'p { margin: 0; }\n' * 100)
+            # Incompressible content is stored even when deflate is asked for:
+            book.writestr('noise.txt', os.urandom(1000))
+        infos = zipfile.ZipFile(self.path).infolist()
+        self.assertEqual(
+                [zipfile.ZIP_STORED, zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED,
+                    zipfile.ZIP_STORED],
+                [info.compress_type for info in infos])
+
+    def test_open_entry(self):
+        """Members can be streamed into the archive"""
+        from epub.format import Epub, Publication
+        import epub.format
+        pub = Publication('unique-id', 'The Sedan Chair', 'Mark Smith',
+                'Smith, Mark')
+        for index in range(100):
+            pub.add_item('c%d.html' % index)
+        directory = tempfile.mkdtemp()
+        threshold = epub.format.STREAM_THRESHOLD
+        try:
+            source = os.path.join(directory, 'big.html')
+            with open(source, 'wb') as out:
+                out.write(CHAPTER * 100)
+            epub.format.STREAM_THRESHOLD = 1024
+            with Epub(self.path, workers=2) as book:
+                book.writestr('first.html', CHAPTER)
+                with book.open_entry('OEBPS/content.opf') as entry:
+                    self.assertRaises(RuntimeError,
+                            book.writestr, 'other.html', CHAPTER)
+                    pub.write_opf(entry)
+                entry = book.open_entry('OEBPS/c1.html')
+                for _ in range(50):
+                    entry.write(CHAPTER)
+                entry.close()
+                book.write(source, 'OEBPS/big.html')
+                book.writestr('last.html', CHAPTER)
+        finally:
+            epub.format.STREAM_THRESHOLD = threshold
+            shutil.rmtree(directory)
+        archive = zipfile.ZipFile(self.path)
+        self.assertEqual(None, archive.testzip())
+        self.assertEqual(['mimetype', 'first.html', 'OEBPS/content.opf',
+                'OEBPS/c1.html', 'OEBPS/big.html', 'last.html'],
+                archive.namelist())
+        self.assertEqual(CHAPTER * 50, archive.read('OEBPS/c1.html'))
+        self.assertEqual(CHAPTER * 100, archive.read('OEBPS/big.html'))
+        parsed = Publication.from_string(archive.read('OEBPS/content.opf'))
+        self.assertEqual(pub.item_ids, parsed.item_ids)
+
+    def test_update(self):
+        """Unchanged members are copied without recompression"""
+        from epub.format import Epub
+        build_sample(self.path)
+        handle, updated = tempfile.mkstemp(suffix='.epub')
+        os.close(handle)
+        try:
+            with Epub.open(self.path) as reader:
+                pub = reader.publication
+                pub.add_item('c2.html', 'c2')
+                Epub.update(reader, updated, {
+                        'OEBPS/c1.html': CHAPTER.replace('dark', 'light'),
+                        'OEBPS/c2.html': CHAPTER,
+                    }, publication=pub)
+            with Epub.open(self.path) as old:
+                with Epub.open(updated) as new:
+                    self.assertEqual(old.namelist() + ['OEBPS/c2.html'],
+                            new.namelist())
+                    self.assertEqual(None, new.file.testzip())
+                    self.assertEqual(['ncx', 'c1', 'c2'],
+                            new.publication.item_ids)
+                    self.assertEqual(old.read_compressed('OEBPS/toc.ncx')[1],
+                            new.read_compressed('OEBPS/toc.ncx')[1])
+                    self.assertTrue('light' in new.read('OEBPS/c1.html'))
+                    self.assertEqual(CHAPTER, new.read('OEBPS/c2.html'))
+        finally:
+            os.unlink(updated)
+
+    def test_update_in_place(self):
+        """An epub can be updated in place"""
+        from epub.format import Epub
+        members = [('OEBPS/m%d.bin' % index, os.urandom(100000))
+                for index in range(20)]
+        with Epub(self.path) as book:
+            for archive_path, data in members:
+                book.writestr(archive_path, data)
+        grown = os.urandom(300000)
+        Epub.update(self.path, self.path, {'OEBPS/m1.bin': grown})
+        with Epub.open(self.path) as updated:
+            self.assertEqual(None, updated.file.testzip())
+            self.assertEqual(grown, updated.read('OEBPS/m1.bin'))
+            self.assertEqual(members[-1][1], updated.read(members[-1][0]))
+        self.assertEqual([os.path.basename(self.path)],
+                [name for name in os.listdir(os.path.dirname(self.path))
+                    if name.startswith(os.path.basename(self.path))])
+
+    def test_update_toc(self):
+        """A toc can only be written where the manifest has an NCX file"""
+        from epub.format import Epub, Publication
+        build_sample(self.path)
+        handle, updated = tempfile.mkstemp(suffix='.epub')
+        os.close(handle)
+        try:
+            with Epub.open(self.path) as reader:
+                toc = reader.toc
+                toc.title = 'Renamed'
+                pub = Publication('unique-id', 'The Sedan Chair',
+                        'Mark Smith', 'Smith, Mark')
+                pub.add_item('c1.html', 'c1')
+                self.assertRaises(ValueError, Epub.update, reader, updated,
+                        publication=pub, toc=toc)
+                pub.add_item('contents.ncx', 'ncx')
+                Epub.update(reader, updated, removed=['OEBPS/toc.ncx'],
+                        publication=pub, toc=toc)
+            with Epub.open(updated) as new:
+                self.assertEqual('OEBPS/contents.ncx', new.ncx_path)
+                self.assertEqual('Renamed', new.toc.title)
+                self.assertFalse('OEBPS/toc.ncx' in new.namelist())
+        finally:
+            os.unlink(updated)
+
+    def test_pipe(self):
+        """Archives can be streamed to a pipe"""
+        import threading
+        from epub.format import Epub
+        read_fd, write_fd = os.pipe()
+        received = []
+        reader = threading.Thread(
+                target=lambda: received.append(os.fdopen(read_fd, 'rb').read()))
+        reader.start()
+        with os.fdopen(write_fd, 'wb') as pipe:
+            with Epub(pipe) as book:
+                self.assertFalse(book.seekable)
+                book.writestr('OEBPS/c1.html', CHAPTER)
+                with book.open_entry('OEBPS/c2.html') as entry:
+                    for _ in range(100):
+                        entry.write(CHAPTER)
+                book.writestr('OEBPS/c3.html', CHAPTER)
+        reader.join()
+        from io import BytesIO
+        archive = zipfile.ZipFile(BytesIO(received[0]))
+        self.assertEqual(None, archive.testzip())
+        self.assertEqual(0, archive.getinfo('mimetype').flag_bits & 0x08)
+        self.assertEqual(0x08,
+                archive.getinfo('OEBPS/c2.html').flag_bits & 0x08)
+        self.assertEqual(CHAPTER * 100, archive.read('OEBPS/c2.html'))
+        self.assertEqual(CHAPTER, archive.read('OEBPS/c3.html'))
+
+    def test_write_only_stream(self):
+        """Members are sent to a write-only stream as they are written"""
+        from epub.format import Epub
+
+        class Sink(object):
+            def __init__(self):
+                self.chunks = []
+
+            def write(self, data):
+                self.chunks.append(data)
+
+        sink = Sink()
+        book = Epub(sink)
+        book.writestr('OEBPS/c1.html', CHAPTER)
+        self.assertTrue(b'OEBPS/c1.html' in b''.join(sink.chunks))
+        book.close()
+        from io import BytesIO
+        archive = zipfile.ZipFile(BytesIO(b''.join(sink.chunks)))
+        self.assertEqual(['mimetype', 'OEBPS/c1.html'], archive.namelist())
+
+    def test_memory_budget(self):
+        """Members over the memory budget are spooled or streamed"""
+        from epub.format import Epub
+        contents = [CHAPTER * (index + 1) for index in range(20)]
+        budget = len(CHAPTER) * 30
+        for workers in (None, 4):
+            with Epub(self.path, workers=workers,
+                    memory_budget=budget) as book:
+                for index, content in enumerate(contents):
+                    book.writestr('OEBPS/c%d.html' % index, content)
+            self.assertTrue(0 < book.peak_buffered <= budget)
+            self.assertEqual(0, book.buffered)
+            if workers:
+                self.assertTrue(book.spilled > 0)
+            archive = zipfile.ZipFile(self.path)
+            self.assertEqual(None, archive.testzip())
+            for index, content in enumerate(contents):
+                self.assertEqual(content,
+                        archive.read('OEBPS/c%d.html' % index))
+
+    def test_memory_budget_reproducible(self):
+        """Spilling does not change the archive"""
+        import random
+        from epub.format import Epub, archive
+        generator = random.Random(1)
+        contents = [CHAPTER * generator.randint(1, 50) for _ in range(30)]
+        contents += [bytes(bytearray(generator.randint(0, 255)
+                for _ in range(5000))) for _ in range(30)]
+        handle, source = tempfile.mkstemp()
+        self.addCleanup(os.unlink, source)
+        os.write(handle, contents[-1] * 3)
+        os.close(handle)
+        os.utime(source, (1000000000, 1000000000))
+        outputs = set()
+        for workers, budget in [(None, None), (4, None), (4, 100000),
+                (4, 100000), (4, 8000), (None, 8000), (None, 4000)]:
+            with Epub(self.path, workers=workers, reproducible=True,
+                    policy=archive.SMALLEST_POLICY,
+                    memory_budget=budget) as book:
+                for index, content in enumerate(contents):
+                    book.writestr('OEBPS/m%d' % index, content)
+                book.write(source, 'OEBPS/source')
+            with open(self.path, 'rb') as result:
+                outputs.add(result.read())
+        self.assertEqual(1, len(outputs))
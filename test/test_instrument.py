@@ -0,0 +1,83 @@
+import unittest
+from io import BytesIO
+from StringIO import StringIO
+
+
+class InstrumentTestCase(unittest.TestCase):
+    def test_collect(self):
+        """Stages are reported to a collecting Aggregator"""
+        from epub import instrument
+        from epub.format import Epub, Publication
+        from epub.format.toc import TableOfContents, NavPoint
+        with instrument.collect(keep_events=True) as stats:
+            pub = Publication('unique-id', 'The Sedan Chair', 'Mark Smith',
+                    'Smith, Mark')
+            pub.add_item('c1.html')
+            opf = pub.as_opf()
+            Publication.from_string(opf.encode('utf-8'))
+            toc = TableOfContents('unique-id', 'The Sedan Chair', 'Mark Smith')
+            toc.nav_points.append(NavPoint('Chapter 1', 'c1.html'))
+            toc.to_ncx()
+            with Epub(BytesIO(), workers=2) as book:
+                book.writestr('OEBPS/content.opf', opf)
+        self.assertEqual([], instrument.listeners)
+        totals = stats.stats()
+        for stage in ['opf.render', 'opf.parse_xml', 'opf.from_root',
+                'ncx.render', 'archive.compress']:
+            self.assertEqual(1, totals[stage]['count'])
+        self.assertFalse('ncx.write' in totals)
+        self.assertEqual(len(opf), totals['opf.render']['output_bytes'])
+        self.assertEqual(len(opf), totals['archive.compress']['input_bytes'])
+        names = [e.name for e in stats.events if e.stage == 'archive.write']
+        self.assertEqual(['mimetype', 'OEBPS/content.opf'], names)
+        out = StringIO()
+        stats.dump(out)
+        self.assertTrue('archive.write' in out.getvalue())
+
+    def test_sizes(self):
+        """Sizes are reported in encoded bytes, for files and streams"""
+        import os
+        import tempfile
+        from epub import instrument
+        from epub.format import Container, Publication
+        from epub.format.toc import TableOfContents, NavPoint
+        pub = Publication('unique-id', u'La Chaise \xe0 Porteurs',
+                'Mark Smith', 'Smith, Mark')
+        pub.add_item('c1.html')
+        toc = TableOfContents('unique-id', u'La Chaise \xe0 Porteurs',
+                'Mark Smith')
+        toc.nav_points.append(NavPoint(u'Chapitre \xe9t\xe9', 'c1.html'))
+        container = Container()
+        container.add_rootfile('OEBPS/content.opf')
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            with instrument.collect() as stats:
+                opf = pub.as_opf()
+                ncx = toc.to_ncx()
+                xml = container.as_epub_container()
+                opf_out, ncx_out = BytesIO(), BytesIO()
+                pub.write_opf(opf_out)
+                toc.write_ncx(ncx_out)
+                toc.write_ncx(path)
+                Container().parse(BytesIO(xml.encode('utf-8')))
+                Container.iterparse(BytesIO(xml.encode('utf-8')))
+                TableOfContents.from_file(path)
+        finally:
+            os.unlink(path)
+        totals = stats.stats()
+        self.assertEqual(len(opf.encode('utf-8')),
+                totals['opf.render']['output_bytes'])
+        self.assertEqual(len(ncx.encode('utf-8')),
+                totals['ncx.render']['output_bytes'])
+        self.assertNotEqual(len(ncx), totals['ncx.render']['output_bytes'])
+        self.assertEqual(len(xml.encode('utf-8')),
+                totals['container.render']['output_bytes'])
+        self.assertEqual(len(opf_out.getvalue()),
+                totals['opf.write']['output_bytes'])
+        self.assertEqual(len(ncx_out.getvalue()) * 2,
+                totals['ncx.write']['output_bytes'])
+        self.assertEqual(len(ncx_out.getvalue()),
+                totals['ncx.parse_xml']['input_bytes'])
+        self.assertEqual(len(xml.encode('utf-8')) * 2,
+                totals['container.parse']['input_bytes'])
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+class LazyTestCase(unittest.TestCase):
+    def test_import(self):
+        """importing epub.format imports neither lxml nor jinja2"""
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        output = subprocess.check_output([sys.executable, '-c',
+                'import sys, epub.format; '
+                'print(sorted(m for m in ["lxml.etree", "jinja2"] '
+                'if m in sys.modules))'], env=env)
+        self.assertEqual('[]', output.decode('utf-8').strip())
+
+    def test_module(self):
+        from epub import lazy
+        etree = lazy.module('lxml.etree')
+        from lxml import etree as real
+        self.assertTrue(etree.XPath is real.XPath)
+        self.assertTrue('XPath' in etree.__dict__)
+
+    def test_template(self):
+        from epub import lazy
+        template = lazy.Template('Hello {{ name }}')
+        self.assertEqual(None, template.compiled)
+        self.assertEqual('Hello world', template.render(name='world'))
+        compiled = template.compiled
+        self.assertEqual('Hello you', template.render(name='you'))
+        self.assertTrue(compiled is template.compiled)
+
+    def test_xpath(self):
+        from epub import lazy
+        from lxml import etree
+        xpath = lazy.XPath('x:b/text()', namespaces={'x': 'urn:x'},
+                smart_strings=False)
+        root = etree.fromstring('<a xmlns="urn:x"><b>one</b><b>two</b></a>')
+        self.assertEqual(['one', 'two'], xpath(root))
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lxml import etree
+
+MESSY = """<html><head><title>Chapter 1</title></head>
+<body><p>It was a <span>dark</span> and stormy night.<br><p>Unclosed
+</body></html>"""
+
+
+def add_ids(tree):
+    from epub.process.lxmlext import xhtml
+    for i, p in enumerate(tree.getroot().iter(xhtml + 'p')):
+        p.set('id', 'p%d' % i)
+
+
+class PipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pairs = []
+        for name in ['c1.html', 'c2.html']:
+            source = os.path.join(self.directory, name)
+            with open(source, 'w') as out:
+                out.write(MESSY)
+            self.pairs.append(
+                    (source, os.path.join(self.directory, 'out', name)))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _pipeline(self, unwrap=('span',), **kwargs):
+        from epub.build.pipeline import Pipeline
+        from epub.process.lxmlext import xhtml
+        from epub.process.transform import Transformer
+        transformer = Transformer()
+        transformer.unwrap(*[xhtml + tag for tag in unwrap])
+        return Pipeline([transformer, add_ids], tidy=True, processes=2,
+                signature_path=os.path.join(self.directory, 'signatures'),
+                **kwargs)
+
+    def test_tidy(self):
+        from epub.build.pipeline import tidy
+        from epub.process.lxmlext import xhtml
+        root = tidy(MESSY.encode('utf-8')).getroot()
+        self.assertEqual(xhtml + 'html', root.tag)
+        self.assertEqual(2, len(list(root.iter(xhtml + 'p'))))
+        self.assertEqual(1, len(list(root.iter(xhtml + 'br'))))
+
+    def test_build(self):
+        from epub.process.lxmlext import xhtml
+        with self._pipeline() as pipeline:
+            built = pipeline.build(self.pairs)
+            self.assertEqual(sorted(target for source, target in self.pairs),
+                    sorted(built))
+            # Nothing has changed, so nothing is rebuilt:
+            self.assertEqual([], pipeline.build(self.pairs))
+        root = etree.parse(self.pairs[0][1]).getroot()
+        self.assertEqual([], list(root.iter(xhtml + 'span')))
+        self.assertEqual(['p0', 'p1'],
+                [p.get('id') for p in root.iter(xhtml + 'p')])
+
+        # Signatures persist between pipelines:
+        with open(self.pairs[1][0], 'a') as out:
+            out.write('\n')
+        with self._pipeline() as pipeline:
+            self.assertEqual([self.pairs[1][1]], pipeline.build(self.pairs))
+        # Changing the pipeline rebuilds everything:
+        with self._pipeline(version='2') as pipeline:
+            self.assertEqual(2, len(pipeline.build(self.pairs)))
+        # As does removing a target:
+        os.remove(self.pairs[0][1])
+        with self._pipeline(version='2') as pipeline:
+            self.assertEqual([self.pairs[0][1]], pipeline.build(self.pairs))
+
+    def test_key(self):
+        """The pipeline key changes with the configuration of its steps"""
+        key = self._pipeline(unwrap=('span', 'font', 'big')).key
+        self.assertEqual(key,
+                self._pipeline(unwrap=('big', 'span', 'font')).key)
+        self.assertNotEqual(key, self._pipeline().key)
+        with self._pipeline() as pipeline:
+            self.assertEqual(2, len(pipeline.build(self.pairs)))
+        with self._pipeline(unwrap=()) as pipeline:
+            self.assertEqual(2, len(pipeline.build(self.pairs)))
@@ -54,4 +54,76 @@ class PublicationTestCase(unittest.TestCase):
     def test_parsing(self):
         """Can parse Publication from string"""
         p = self._get_pub_class().from_string(SAMPLE_OPF)
-        print p.as_opf()
\ No newline at end of file
+        print p.as_opf()
+    def test_item_lookup(self):
+        """Items can be looked up by id and href"""
+        p = self._get_pub_class().from_string(SAMPLE_OPF)
+        self.assertEqual('cover.jpg', p.get_item('cover').href)
+        self.assertEqual('page_1', p.get_item_by_href('index.html').item_id)
+        self.assertEqual(None, p.get_item_by_href('missing.html'))
+        self.assertTrue(p.has_item('page_1'))
+        self.assertRaises(IndexError, p.get_item, 'missing')
+        self.assertRaises(RuntimeError, p.add_item, 'other.html', 'cover')
+        self.assertEqual(None, p.get_ncx_item())
+        p.add_item('toc.ncx', 'ncx')
+        self.assertEqual('ncx', p.get_ncx_item().item_id)
+
+    def test_many_items(self):
+        """Generated ids stay unique across many items"""
+        p = self._get_pub_instance('unique-id', 'The Sedan Chair',
+                'Mark Smith', 'Smith, Mark')
+        for index in range(2000):
+            p.add_item('page%d.html' % index)
+        self.assertEqual(2000, len(set(p.item_ids)))
+        self.assertEqual(2000, len(p.spine_items))
+
+    def test_write_opf(self):
+        """Streamed OPF output parses to the same Publication"""
+        from io import BytesIO
+        p = self._get_pub_class().from_string(SAMPLE_OPF)
+        stream = BytesIO()
+        p.write_opf(stream)
+        q = self._get_pub_class().from_string(stream.getvalue())
+        r = self._get_pub_class().from_string(p.as_opf().encode('utf-8'))
+        for other in (q, r):
+            self.assertEqual(p.title, other.title)
+            self.assertEqual(p.authors, other.authors)
+            self.assertEqual(p.lang, other.lang)
+            self.assertEqual(p.item_ids, other.item_ids)
+            self.assertEqual([i.item_id for i in p.spine_items],
+                    [i.item_id for i in other.spine_items])
+
+    def test_iterparse(self):
+        """Incremental parsing gives the same Publication"""
+        from io import BytesIO
+        p = self._get_pub_class().from_string(SAMPLE_OPF)
+        q = self._get_pub_class().iterparse(BytesIO(SAMPLE_OPF))
+        self.assertEqual((p.title, p.unique_id, p.authors, p.lang),
+                (q.title, q.unique_id, q.authors, q.lang))
+        self.assertEqual([(i.item_id, i.href, i.media_type, i.spine_item)
+                    for i in p.items],
+                [(i.item_id, i.href, i.media_type, i.spine_item)
+                    for i in q.items])
+        self.assertEqual(['page_1'], [i.item_id for i in q.spine_items])
+
+    def test_compact_items(self):
+        """ManifestItems share media-type strings"""
+        p = self._get_pub_class().from_string(SAMPLE_OPF)
+        p.add_item('other.html')
+        first, _, last = p.items
+        self.assertFalse(hasattr(first, '__dict__'))
+        self.assertTrue(first.media_type is last.media_type)
+
+    def test_stable_ids(self):
+        """Stable ids depend only on the href"""
+        ids = []
+        for _ in range(2):
+            p = self._get_pub_instance('unique-id', 'The Sedan Chair',
+                    'Mark Smith', 'Smith, Mark', stable_ids=True)
+            p.add_item('index.html')
+            p.add_item('cover.jpg')
+            ids.append(p.item_ids)
+        self.assertEqual(ids[0], ids[1])
+        self.assertNotEqual(ids[0][0], ids[0][1])
+        # Clashing ids are made unique:
+        self.assertEqual(ids[0][0] + '-1', p.generate_stable_id('index.html'))
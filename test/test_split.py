@@ -0,0 +1,104 @@
+import posixpath
+import unittest
+
+from lxml import etree
+
+XHTML = '{http://www.w3.org/1999/xhtml}'
+
+
+def chapter(body):
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml">'
+            '<head><title>Chapter</title></head>'
+            '<body>%s</body></html>' % body).encode('utf-8')
+
+
+def paragraphs(start, count):
+    return ''.join('<p id="p%d">Paragraph %d. It was a dark and stormy '
+            'night.</p>' % (index, index) for index in range(start,
+            start + count))
+
+
+class SplitTestCase(unittest.TestCase):
+    def setUp(self):
+        from epub.format import Publication, TableOfContents
+        from epub.format.toc import NavPoint
+        self.pub = Publication('unique-id', 'The Sedan Chair', 'Mark Smith',
+                'Smith, Mark')
+        self.toc = TableOfContents('unique-id', 'The Sedan Chair',
+                'Mark Smith')
+        self.toc.nav_points.append(NavPoint('Chapter 1', 'text/c1.html'))
+        self.toc.nav_points.append(NavPoint('Section', 'text/c1.html#p70'))
+        self.c1 = chapter('<p><a href="#p70">Forward</a></p>'
+                + paragraphs(0, 40)
+                + '<section id="s1">%s</section>' % paragraphs(40, 40))
+        self.c2 = chapter('<p><a href="c1.html#p75">Back</a>'
+                '<a href="c1.html">Start</a>'
+                '<a href="http://example.com/c1.html#p75">Away</a></p>')
+
+    def test_split(self):
+        from epub.process.split import split_documents
+        result = split_documents([('text/c1.html', self.c1, 'c1'),
+                ('text/c2.html', self.c2, 'c2')], self.pub, self.toc,
+                max_size=1024)
+        hrefs = [href for href, data in result]
+        self.assertTrue(len(hrefs) > 3)
+        self.assertEqual('text/c1.html', hrefs[0])
+        self.assertEqual('text/c1-2.html', hrefs[1])
+        self.assertEqual('text/c2.html', hrefs[-1])
+        self.assertEqual(hrefs, [item.href for item in self.pub.spine_items])
+        self.assertEqual(['c1', 'c1-2'], self.pub.item_ids[:2])
+
+        roots = dict((href, etree.fromstring(data)) for href, data in result)
+        ids = []
+        for href in hrefs[:-1]:
+            self.assertTrue(len(etree.tostring(roots[href])) <= 1024)
+            ids.extend(p.get('id') for p in roots[href].iter(XHTML + 'p')
+                    if p.get('id'))
+        self.assertEqual(['p%d' % index for index in range(80)], ids)
+        # The section is split, keeping its id only in its first part:
+        sections = [section for href in hrefs
+                for section in roots[href].iter(XHTML + 'section')]
+        self.assertTrue(len(sections) > 1)
+        self.assertEqual(['s1'] + [None] * (len(sections) - 1),
+                [section.get('id') for section in sections])
+
+        part70 = [href for href in hrefs
+                if roots[href].xpath('//*[@id="p70"]')][0]
+        part75 = [href for href in hrefs
+                if roots[href].xpath('//*[@id="p75"]')][0]
+        forward = roots['text/c1.html'].find('.//' + XHTML + 'a')
+        self.assertEqual(posixpath.basename(part70) + '#p70',
+                forward.get('href'))
+        links = [a.get('href') for a in
+                roots['text/c2.html'].iter(XHTML + 'a')]
+        self.assertEqual([posixpath.basename(part75) + '#p75', 'c1.html',
+                'http://example.com/c1.html#p75'], links)
+        self.assertEqual(['text/c1.html', part70 + '#p70'],
+                [npoint.link for npoint in self.toc.depth_first()])
+
+    def test_body_text(self):
+        """Text directly in the body is kept in the first part only"""
+        from epub.process.split import split_document
+        tree = etree.ElementTree(etree.fromstring(
+                chapter('Intro text' + paragraphs(0, 40))))
+        parts = split_document(tree, max_size=1024)
+        self.assertTrue(len(parts) > 1)
+        texts = [etree.tostring(part).decode('utf-8').count('Intro text')
+                for part in parts]
+        self.assertEqual([1] + [0] * (len(parts) - 1), texts)
+
+    def test_small(self):
+        """Small documents and other items are registered in order"""
+        from epub.process.split import split_documents
+        result = split_documents([('text/cover.jpg', None, None),
+                ('text/c1.html', self.c1, None),
+                ('text/note.html', None, 'note', {'spine_item': False})],
+                self.pub, self.toc)
+        self.assertEqual([('text/cover.jpg', None), ('text/c1.html', self.c1),
+                ('text/note.html', None)], result)
+        self.assertEqual(['text/cover.jpg', 'text/c1.html', 'text/note.html'],
+                [item.href for item in self.pub.items])
+        self.assertEqual(['text/c1.html'],
+                [item.href for item in self.pub.spine_items])
+
@@ -75,4 +75,152 @@ class TableOfContentsTestCase(unittest.TestCase):
         
     def test_parse(self):
         """Parse TableOfContents XML"""
-        self.assertTrue(self._get_toc().from_string(SAMPLE).to_ncx())
\ No newline at end of file
+        self.assertTrue(self._get_toc().from_string(SAMPLE).to_ncx())
+    def test_round_trip(self):
+        """NCX output parses back to the same tree"""
+        toc = self._get_toc().from_string(SAMPLE)
+        parsed = self._get_toc().from_string(toc.to_ncx().encode('utf-8'))
+        self.assertEqual(toc.unique_id, parsed.unique_id)
+        self.assertEqual(toc.authors, parsed.authors)
+        self.assertEqual(3, parsed.depth())
+        self.assertEqual(
+                [(np.point_id, np.label, np.link, np.play_order)
+                    for np in toc.depth_first()],
+                [(np.point_id, np.label, np.link, index + 1)
+                    for index, np in enumerate(parsed.depth_first())])
+
+    def test_deep(self):
+        """Very deep trees can be measured and written"""
+        import sys
+        NavPoint = self._get_navpoint()
+        toc = self._get_toc()('blblbl', 'Sample Contents', 'Sample Author')
+        parent = toc
+        levels = sys.getrecursionlimit() * 2
+        for index in range(levels):
+            np = NavPoint('Level %d' % index, 'c.html#%d' % index)
+            parent.nav_points.append(np)
+            parent = np
+        self.assertEqual(levels, toc.depth())
+        self.assertEqual(levels, len(list(toc.depth_first())))
+        ncx = toc.to_ncx()
+        self.assertEqual(levels, ncx.count('<navPoint '))
+        self.assertEqual(levels, parent.play_order)
+
+    def test_parse_class(self):
+        """navPoint class attributes are parsed as strings"""
+        toc = self._get_toc().from_string(SAMPLE.replace(
+                '<navPoint id="c2"', '<navPoint class="chapter" id="c2"'))
+        self.assertEqual([None, None, None, None, 'chapter'],
+                [np.cls for np in toc.depth_first()])
+        self.assertTrue('class="chapter"' in toc.to_ncx())
+
+    def test_iterparse(self):
+        """Incremental parsing gives the same TableOfContents"""
+        from io import BytesIO
+        toc = self._get_toc().from_string(SAMPLE)
+        parsed = self._get_toc().iterparse(BytesIO(SAMPLE))
+        self.assertEqual((toc.unique_id, toc.title, toc.authors),
+                (parsed.unique_id, parsed.title, parsed.authors))
+        self.assertEqual(
+                [(np.point_id, np.label, np.link, np.cls, len(np.nav_points))
+                    for np in toc.depth_first()],
+                [(np.point_id, np.label, np.link, np.cls, len(np.nav_points))
+                    for np in parsed.depth_first()])
+
+    def test_compact_nav_point(self):
+        """NavPoints create their children and ids lazily"""
+        NavPoint = self._get_navpoint()
+        np = NavPoint('Chapter 1', 'c1.html')
+        self.assertFalse(hasattr(np, '__dict__'))
+        self.assertEqual(None, np._nav_points)
+        self.assertEqual(1, np.depth())
+        self.assertEqual([np], list(np.depth_first()))
+        self.assertEqual(None, np._nav_points)
+        self.assertEqual(None, np.given_point_id)
+        self.assertEqual(None, np._point_id)
+        point_id = np.point_id
+        self.assertEqual(8, len(point_id))
+        self.assertEqual(point_id, np.point_id)
+        self.assertEqual(None, np.given_point_id)
+        self.assertEqual('c1', NavPoint('Chapter 1', 'c1.html',
+                'c1').given_point_id)
+        np.nav_points.append(NavPoint('Section 1', 'c1.html#s1', 's1'))
+        self.assertEqual(2, np.depth())
+
+    def test_edit(self):
+        """Depth and play order are maintained through edits"""
+        NavPoint = self._get_navpoint()
+        toc = self._get_toc().from_string(SAMPLE)
+        points = dict((np.point_id, np) for np in toc.depth_first())
+
+        def check():
+            expected = list(toc.depth_first())
+            self.assertEqual(range(1, len(expected) + 1),
+                    [toc.play_order(np) for np in expected])
+            toc._indexed = False
+            self.assertEqual(toc.depth(), self._get_toc().depth(toc))
+            toc._indexed = True
+
+        self.assertEqual(3, toc.play_order(points['c1_1']))
+        self.assertEqual(3, toc.depth())
+        toc.insert(None, 1, NavPoint('Interlude', 'i.html', 'i'))
+        self.assertEqual(3, toc.play_order(points['c1']))
+        check()
+        deep = NavPoint('Deep', 'c1.html#deep', 'deep')
+        deep.nav_points.append(NavPoint('Deeper', 'c1.html#deeper', 'dr'))
+        toc.append(points['c1_1_1'], deep)
+        self.assertEqual(5, toc.depth())
+        self.assertEqual(8, toc.play_order(points['c2']))
+        check()
+        toc.move(points['c1_1'], points['c2'])
+        self.assertEqual(
+                ['p', 'i', 'c1', 'c2', 'c1_1', 'c1_1_1', 'deep', 'dr'],
+                [np.point_id for np in toc.depth_first()])
+        self.assertEqual(5, toc.depth())
+        check()
+        self.assertRaises(ValueError, toc.move, points['c2'], deep)
+        toc.remove(points['c1_1'])
+        self.assertEqual(1, toc.depth())
+        self.assertEqual(4, toc.play_order(points['c2']))
+        check()
+        ncx = toc.to_ncx()
+        self.assertTrue('<meta content="1" name="dtb:depth">' in ncx)
+        self.assertRaises(ValueError, toc.play_order, points['c1_1'])
+
+    def test_stable_ids(self):
+        """Stable ids are derived when written, and always unique"""
+        from epub.format.toc import TableOfContents
+        NavPoint = self._get_navpoint()
+
+        def build():
+            toc = TableOfContents('unique-id', 'Title', 'Author', True)
+            toc.nav_points.append(NavPoint('Chapter 1', 'c1.html'))
+            toc.nav_points.append(NavPoint('Chapter 1', 'c1.html'))
+            toc.nav_points.append(NavPoint('Chapter 2', 'c2.html'))
+            return toc
+
+        def ids(toc):
+            return [point.point_id for point in
+                    TableOfContents.from_string(
+                    toc.to_ncx().encode('utf-8')).depth_first()]
+
+        toc = build()
+        # Reading an id before writing does not stop it being derived:
+        toc.nav_points[0].point_id
+        first = ids(toc)
+        self.assertEqual(first, ids(build()))
+        self.assertEqual(3, len(set(first)))
+        self.assertEqual(first[0] + '-2', first[1])
+        self.assertEqual([point.point_id for point in toc.depth_first()],
+                first)
+
+        toc.insert(None, 0, NavPoint('Preface', 'preface.html'))
+        second = ids(toc)
+        self.assertEqual(4, len(set(second)))
+        self.assertEqual(first, second[1:])
+
+        # Given ids are kept, and never duplicated:
+        toc.nav_points[0].point_id = first[0]
+        third = ids(toc)
+        self.assertEqual(4, len(set(third)))
+        self.assertEqual(first[0], third[0])
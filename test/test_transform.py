@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lxml import etree
+
+DOCUMENT = """<html xmlns="http://www.w3.org/1999/xhtml"><body>
+<p class="a" style="color: red">One <span>two <b>three</b> four</span> five</p>
+<p>  </p>
+<div><span>six</span><span> </span>seven<span><i>eight</i></span>nine</div>
+<p><span><span>ten</span></span><span/>eleven</p>
+<div><p/></div>
+</body></html>"""
+
+
+def _serialise(root):
+    return etree.tostring(root, encoding='unicode' if str is not bytes
+            else None)
+
+
+def _postorder(element):
+    result = []
+    for child in element:
+        result.extend(_postorder(child))
+    result.append(element)
+    return result
+
+
+class TransformerTestCase(unittest.TestCase):
+    def _transformer(self):
+        from epub.process.lxmlext import xhtml
+        from epub.process.transform import Transformer
+        transformer = Transformer()
+        transformer.unwrap(xhtml + 'span')
+        transformer.drop_empty(xhtml + 'p', xhtml + 'div')
+        transformer.rename(xhtml + 'b', xhtml + 'strong')
+        transformer.strip_attributes(xhtml + 'p', 'style')
+        return transformer
+
+    def test_unwrap_matches_replace_tag_with_contents(self):
+        from epub.process.lxmlext import xhtml, replace_tag_with_contents
+        from epub.process.transform import Transformer
+        expected = etree.fromstring(DOCUMENT)
+        # Children before their parents, otherwise in document order:
+        for span in _postorder(expected):
+            if span.tag == xhtml + 'span':
+                replace_tag_with_contents(span)
+        transformer = Transformer()
+        transformer.unwrap(xhtml + 'span')
+        actual = transformer.apply(etree.fromstring(DOCUMENT))
+        self.assertEqual(_serialise(expected), _serialise(actual))
+
+    def test_nested_unwrap(self):
+        """Nested unwraps match the helper applied innermost first"""
+        import random
+        from epub.process.lxmlext import replace_tag_with_contents
+        from epub.process.transform import Transformer
+        transformer = Transformer()
+        transformer.unwrap('span')
+        # Applied outermost first, the helper would leave ' x':
+        root = transformer.apply(etree.fromstring(
+                '<r><span><span/></span>x</r>'))
+        self.assertEqual('x', root.text)
+        root = transformer.apply(etree.fromstring(
+                '<r><a/><span><span/><span></span>x9</span></r>'))
+        self.assertEqual(' x9', root[0].tail)
+
+        def content(depth):
+            pieces = []
+            for _ in range(rng.randint(0, 3)):
+                if rng.random() < 0.3:
+                    pieces.append(rng.choice(['x', ' ', 'y z']))
+                tag = rng.choice(['span', 'span', 'a'])
+                pieces.append('<%s>%s</%s>' % (tag,
+                        content(depth - 1) if depth else '', tag))
+            if rng.random() < 0.3:
+                pieces.append('w')
+            return ''.join(pieces)
+        rng = random.Random(1)
+        for _ in range(300):
+            document = '<r>%s</r>' % content(3)
+            expected = etree.fromstring(document)
+            for span in _postorder(expected):
+                if span.tag == 'span':
+                    replace_tag_with_contents(span)
+            actual = transformer.apply(etree.fromstring(document))
+            self.assertEqual(_serialise(expected), _serialise(actual),
+                    document)
+
+    def test_apply(self):
+        from epub.process.lxmlext import xhtml
+        root = self._transformer().apply(
+                etree.ElementTree(etree.fromstring(DOCUMENT)))
+        self.assertEqual(0, len(list(root.iter(xhtml + 'span'))))
+        self.assertEqual(0, len(list(root.iter(xhtml + 'b'))))
+        self.assertEqual(1, len(list(root.iter(xhtml + 'strong'))))
+        paragraphs = list(root.iter(xhtml + 'p'))
+        # The whitespace-only paragraph and the one in the emptied div go:
+        self.assertEqual(2, len(paragraphs))
+        self.assertEqual({'class': 'a'}, dict(paragraphs[0].attrib))
+        self.assertEqual('ten eleven', paragraphs[1].text)
+        divs = list(root.iter(xhtml + 'div'))
+        self.assertEqual(1, len(divs))
+        self.assertEqual('six   seven', divs[0].text)
+        self.assertEqual(' nine', divs[0][0].tail)
+
+    def test_transform_directory(self):
+        from epub.process.lxmlext import xhtml
+        from epub.process.transform import transform_directory
+        directory = tempfile.mkdtemp()
+        try:
+            for name in ['c1.xhtml', 'c2.xhtml', 'notes.txt']:
+                with open(os.path.join(directory, name), 'w') as out:
+                    out.write(DOCUMENT)
+            paths = transform_directory(self._transformer(), directory,
+                    processes=2)
+            self.assertEqual(['c1.xhtml', 'c2.xhtml'],
+                    [os.path.basename(path) for path in paths])
+            for path in paths:
+                root = etree.parse(path).getroot()
+                self.assertEqual(0, len(list(root.iter(xhtml + 'span'))))
+            with open(os.path.join(directory, 'notes.txt')) as notes:
+                self.assertEqual(DOCUMENT, notes.read())
+        finally:
+            shutil.rmtree(directory)
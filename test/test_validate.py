@@ -0,0 +1,137 @@
+import os
+import tempfile
+import unittest
+
+CHAPTER = """<html xmlns="http://www.w3.org/1999/xhtml"><body/></html>"""
+
+BAD_SPINE_OPF = """<?xml version="1.0" encoding="UTF-8"?>
+<package version="2.0" xmlns="http://www.idpf.org/2007/opf"
+        unique-identifier="BookId">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/"
+        xmlns:opf="http://www.idpf.org/2007/opf">
+    <dc:title>The Sedan Chair</dc:title>
+    <dc:creator opf:role="aut" opf:file-as="Smith, Mark">Mark Smith</dc:creator>
+    <dc:language>en-US</dc:language>
+    <dc:identifier id="BookId">unique-id</dc:identifier>
+  </metadata>
+  <manifest>
+    <item id="c1" href="c1.html" media-type="application/xhtml+xml"/>
+  </manifest>
+  <spine><itemref idref="c2"/></spine>
+</package>"""
+
+
+class ValidateTestCase(unittest.TestCase):
+    def setUp(self):
+        from epub.format import Container, Publication, TableOfContents
+        from epub.format.toc import NavPoint
+        handle, self.path = tempfile.mkstemp(suffix='.epub')
+        os.close(handle)
+        self.container = Container()
+        self.container.add_rootfile('OEBPS/content.opf')
+        self.pub = Publication('unique-id', 'The Sedan Chair', 'Mark Smith',
+                'Smith, Mark')
+        self.pub.add_item('toc.ncx', 'ncx')
+        self.pub.add_item('c1.html', 'c1')
+        self.toc = TableOfContents('unique-id', 'The Sedan Chair',
+                'Mark Smith')
+        self.toc.nav_points.append(NavPoint('Chapter 1', 'c1.html', 'np1'))
+        self.toc.nav_points[0].nav_points.append(
+                NavPoint('Section 1', 'c1.html#s1', 'np2'))
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def _build(self, members):
+        from epub.format import Epub
+        with Epub(self.path) as book:
+            book.writestr('META-INF/container.xml',
+                    self.container.as_epub_container())
+            for member in members:
+                book.writestr(member, CHAPTER)
+            book.writestr('OEBPS/toc.ncx', self.toc.to_ncx())
+            book.writestr('OEBPS/content.opf', self.pub.as_opf())
+            return book.validate(self.container, self.pub, self.toc)
+
+    def test_valid(self):
+        from epub.format import EpubReader
+        self.assertEqual([], self._build(['OEBPS/c1.html']))
+        with EpubReader(self.path) as reader:
+            self.assertEqual([], reader.validate())
+
+    def test_errors(self):
+        from epub.format import EpubReader
+        from epub.format import validate
+        from epub.format.toc import NavPoint
+        self.toc.nav_points.append(NavPoint('Chapter 2', 'c2.html', 'np1'))
+        expected = [
+            (validate.MISSING_ITEM, 'OEBPS/c1.html'),
+            (validate.UNLISTED_MEMBER, 'OEBPS/extra.html'),
+            (validate.DUPLICATE_POINT_ID, 'np1'),
+            (validate.BROKEN_LINK, 'OEBPS/c2.html'),
+        ]
+        errors = self._build(['OEBPS/extra.html'])
+        self.assertEqual(expected,
+                [(error.code, error.path) for error in errors])
+        with EpubReader(self.path) as reader:
+            self.assertEqual(expected,
+                    [(error.code, error.path) for error in reader.validate()])
+
+    def test_container(self):
+        from epub.format import validate
+        self.container.rootfiles = [('OEBPS/missing.opf',
+                'application/oebps-package+xml')]
+        errors = validate.validate(['mimetype', 'OEBPS/c1.html'],
+                self.container, self.pub)
+        self.assertEqual(validate.MISSING_ROOTFILE, errors[0].code)
+        self.container.rootfiles = []
+        errors = validate.validate(['OEBPS/c1.html'], self.container,
+                self.pub)
+        self.assertEqual([validate.MIMETYPE_NOT_FIRST, validate.NO_ROOTFILE],
+                [error.code for error in errors])
+
+    def test_spine(self):
+        from epub.format import Epub, EpubReader
+        from epub.format import validate
+        from epub.format.publication import ManifestItem
+        self.pub.spine_items.append(ManifestItem('c2.html', 'c2'))
+        errors = validate.validate(['mimetype', 'META-INF/container.xml',
+                'OEBPS/content.opf', 'OEBPS/toc.ncx', 'OEBPS/c1.html'],
+                self.container, self.pub, self.toc)
+        self.assertEqual([(validate.SPINE_NOT_IN_MANIFEST, 'c2')],
+                [(error.code, error.path) for error in errors])
+
+        with Epub(self.path) as book:
+            book.writestr('META-INF/container.xml',
+                    self.container.as_epub_container())
+            book.writestr('OEBPS/content.opf', BAD_SPINE_OPF)
+            book.writestr('OEBPS/c1.html', CHAPTER)
+        with EpubReader(self.path) as reader:
+            errors = reader.validate()
+        self.assertEqual([(validate.SPINE_NOT_IN_MANIFEST, 'c2')],
+                [(error.code, error.path) for error in errors])
+
+    def test_lenient_opf(self):
+        """Every problem in an OPF file is reported, not just the first"""
+        from epub.format import Epub, EpubReader
+        from epub.format import validate
+        opf = BAD_SPINE_OPF.replace(
+                '<dc:language>en-US</dc:language>', '').replace(
+                '</manifest>', '<item id="c1" href="c1b.html" '
+                'media-type="application/xhtml+xml"/>'
+                '<item id="weird" href="weird.xyz"/></manifest>')
+        with Epub(self.path) as book:
+            book.writestr('META-INF/container.xml',
+                    self.container.as_epub_container())
+            book.writestr('OEBPS/content.opf', opf)
+            book.writestr('OEBPS/extra.html', CHAPTER)
+        with EpubReader(self.path) as reader:
+            errors = reader.validate()
+        self.assertEqual([
+            (validate.MISSING_METADATA, 'language'),
+            (validate.DUPLICATE_ID, 'c1'),
+            (validate.UNKNOWN_MEDIA_TYPE, 'weird'),
+            (validate.SPINE_NOT_IN_MANIFEST, 'c2'),
+            (validate.MISSING_ITEM, 'OEBPS/c1.html'),
+            (validate.UNLISTED_MEMBER, 'OEBPS/extra.html'),
+        ], [(error.code, error.path) for error in errors])